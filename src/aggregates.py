@@ -0,0 +1,210 @@
+"""
+Incrementally maintained spending aggregates
+
+Every write path calls apply_insert(), apply_delete() or, for updates,
+apply_changes() inside its own database transaction, so spending_aggregates
+always matches the transactions table and readers never have to scan it. rebuild() recomputes everything from
+scratch for databases written in bulk outside the API (e.g. categorization).
+Each of them also bumps the transactions data version (versioning.py) once,
+so they must be called once per write transaction.
+
+Usage:
+    python aggregates.py instance/transactions.db
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import create_engine, delete, func, select, text, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import SpendingAggregate, Transaction
+from queries import BOOKING_DATE_TEXT, date_text
+import versioning
+
+DIMENSIONS = ('total', 'month', 'category', 'merchant')
+
+# month keys are derived the same way in Python and in SQL
+MONTH_SQL = "strftime('%Y-%m', booking_date)"
+
+REBUILD_SQL = [
+    "DELETE FROM spending_aggregates",
+    """INSERT INTO spending_aggregates (dimension, key, direction, count, total, max_amount)
+       SELECT 'total', '', direction, COUNT(*), SUM(amount), MAX(amount)
+       FROM transactions GROUP BY direction""",
+    f"""INSERT INTO spending_aggregates (dimension, key, direction, count, total, max_amount)
+       SELECT 'month', COALESCE({MONTH_SQL}, ''), direction, COUNT(*), SUM(amount), MAX(amount)
+       FROM transactions GROUP BY 2, direction""",
+    """INSERT INTO spending_aggregates (dimension, key, direction, count, total, max_amount)
+       SELECT 'category', COALESCE(category, ''), direction, COUNT(*), SUM(amount), MAX(amount)
+       FROM transactions GROUP BY 2, direction""",
+    """INSERT INTO spending_aggregates (dimension, key, direction, count, total, max_amount)
+       SELECT 'merchant', COALESCE(merchant_name, ''), direction, COUNT(*), SUM(amount), MAX(amount)
+       FROM transactions GROUP BY 2, direction""",
+    versioning.transactions.bump_sql,
+]
+
+
+def _row_values(row) -> Dict[str, Any]:
+    if isinstance(row, dict):
+        return row
+    return {c: getattr(row, c) for c in ('direction', 'amount', 'booking_date', 'category', 'merchant_name')}
+
+
+def _keys(row: Dict[str, Any]) -> List[Tuple[str, str]]:
+    booking_date = row.get('booking_date')
+    return [
+        ('total', ''),
+        ('month', booking_date.strftime('%Y-%m') if isinstance(booking_date, datetime) else ''),
+        ('category', row.get('category') or ''),
+        ('merchant', row.get('merchant_name') or ''),
+    ]
+
+
+def _matching(dimension: str, key: str, direction: str):
+    """WHERE clause selecting the transactions behind one aggregate row"""
+    criteria = [Transaction.direction == direction]
+    if dimension == 'month':
+        if key:
+            start = datetime.strptime(key, '%Y-%m')
+            end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+            # on the stored text, so dates written without microseconds match too
+            criteria += [BOOKING_DATE_TEXT >= date_text(start), BOOKING_DATE_TEXT < date_text(end)]
+        else:
+            criteria.append(Transaction.booking_date.is_(None))
+    elif dimension in ('category', 'merchant'):
+        column = Transaction.category if dimension == 'category' else Transaction.merchant_name
+        criteria.append(column == key if key else column.is_(None))
+    return criteria
+
+
+def apply_changes(session, removed: Iterable = (), added: Iterable = ()) -> None:
+    """
+    Fold one write into the aggregates: rows removed from transactions
+    (deleted, or the old values of updated rows) and rows added (inserted, or
+    the new values), as ORM objects, rows or column dicts.
+
+    Call after the write has been flushed; session may also be a Connection.
+    Counts and sums are adjusted in place; a max is only recomputed (with an
+    indexed query) when a removed row may have held it.
+    """
+    deltas = defaultdict(lambda: [0, 0.0, None])
+    removed_max: Dict[Tuple[str, str, str], float] = {}
+    for sign, rows in ((-1, removed), (1, added)):
+        for row in rows:
+            row = _row_values(row)
+            amount = row['amount']
+            for dimension, key in _keys(row):
+                ident = (dimension, key, row['direction'])
+                delta = deltas[ident]
+                delta[0] += sign
+                delta[1] += sign * amount
+                if sign > 0:
+                    delta[2] = amount if delta[2] is None else max(delta[2], amount)
+                else:
+                    removed_max[ident] = max(removed_max.get(ident, amount), amount)
+    if not deltas:
+        return
+
+    stmt = insert(SpendingAggregate)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['dimension', 'key', 'direction'],
+        set_={
+            'count': SpendingAggregate.count + stmt.excluded.count,
+            'total': SpendingAggregate.total + stmt.excluded.total,
+            'max_amount': func.max(func.coalesce(SpendingAggregate.max_amount, stmt.excluded.max_amount),
+                                   func.coalesce(stmt.excluded.max_amount, SpendingAggregate.max_amount)),
+        }
+    )
+    session.execute(stmt, [
+        {'dimension': d, 'key': k, 'direction': direction, 'count': c, 'total': t, 'max_amount': m}
+        for (d, k, direction), (c, t, m) in deltas.items()
+    ])
+
+    for dimension, key, direction in removed_max:
+        ident = (SpendingAggregate.dimension == dimension, SpendingAggregate.key == key,
+                 SpendingAggregate.direction == direction)
+        aggregate = session.execute(select(SpendingAggregate.count, SpendingAggregate.max_amount).where(*ident)).first()
+        if aggregate is None:
+            continue
+        if aggregate.count <= 0:
+            session.execute(delete(SpendingAggregate).where(*ident))
+        elif aggregate.max_amount is not None and removed_max[(dimension, key, direction)] >= aggregate.max_amount:
+            session.execute(update(SpendingAggregate).where(*ident).values(max_amount=(
+                select(func.max(Transaction.amount)).where(*_matching(dimension, key, direction)).scalar_subquery()
+            )))
+    versioning.transactions.bump(session)
+
+
+def apply_insert(session, rows: Iterable) -> None:
+    """Fold newly inserted transactions into the aggregates"""
+    apply_changes(session, added=rows)
+
+
+def apply_delete(session, rows: Iterable) -> None:
+    """Remove deleted transactions from the aggregates (call after the DELETE has been flushed)"""
+    apply_changes(session, removed=rows)
+
+
+def rebuild(session) -> None:
+    """Recompute every aggregate from the transactions table"""
+    for sql in REBUILD_SQL:
+        session.execute(text(sql))
+
+
+def ensure_built(session) -> None:
+    """Build the aggregates for a database that has transactions but no aggregates yet"""
+    has_aggregates = session.execute(select(SpendingAggregate.dimension).limit(1)).first()
+    if not has_aggregates and session.execute(select(Transaction.id).limit(1)).first():
+        rebuild(session)
+        session.commit()
+
+
+def totals(session, direction: str) -> Tuple[int, float, Optional[float]]:
+    """(count, sum, max) over all transactions with the given direction"""
+    aggregate = session.get(SpendingAggregate, {'dimension': 'total', 'key': '', 'direction': direction})
+    if aggregate is None:
+        return 0, 0.0, None
+    return aggregate.count, aggregate.total, aggregate.max_amount
+
+
+def transaction_count(session) -> int:
+    return session.execute(
+        select(func.coalesce(func.sum(SpendingAggregate.count), 0)).where(SpendingAggregate.dimension == 'total')
+    ).scalar()
+
+
+def breakdown(session, dimension: str, direction: Optional[str] = None, limit: Optional[int] = None) -> List[SpendingAggregate]:
+    """Aggregates for one dimension, months in calendar order, everything else largest total first"""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"dimension must be one of {', '.join(DIMENSIONS)}")
+    stmt = select(SpendingAggregate).where(SpendingAggregate.dimension == dimension)
+    if direction:
+        stmt = stmt.where(SpendingAggregate.direction == direction)
+    if dimension == 'month':
+        stmt = stmt.order_by(SpendingAggregate.key)
+    else:
+        stmt = stmt.order_by(SpendingAggregate.total.desc())
+    if limit:
+        stmt = stmt.limit(limit)
+    return session.execute(stmt).scalars().all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the spending aggregates of a transactions database")
+    parser.add_argument('db_path', help="Path to the SQLite database file")
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.db_path}")
+    with engine.begin() as conn:
+        versioning.transactions.install(conn)
+    with Session(engine) as session:
+        rebuild(session)
+        session.commit()
+        print(f"Rebuilt spending aggregates for {transaction_count(session)} transactions")
+
+
+if __name__ == "__main__":
+    main()
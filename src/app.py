@@ -1,12 +1,28 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from datetime import datetime
 import json
 import logging
+import os
 import re
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
-from models import db, Transaction
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, DEFAULT_FIELDS, Transaction
+import queries
+import serialization
+import export
+import ingest
+import migrations
+import aggregates
+import versioning
+import storage
+import http_cache
+import monyca
+from singleflight import Overloaded, SingleFlightExecutor
+from shards import ShardRouter
 
 # Create Flask app
 app = Flask(__name__)
@@ -17,6 +33,18 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///transactions.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'hackathon-key'
 
+# LLM-backed chat runs on a bounded pool; beyond workers + queue requests get a 429
+app.config['CHAT_WORKERS'] = 4
+app.config['CHAT_QUEUE'] = 16
+app.config['CHAT_RETRY_AFTER'] = 2
+
+# One SQLite file per user under instance/users; at most this many kept open
+app.config['USER_DB_DIR'] = os.path.join(app.instance_path, 'users')
+app.config['USER_DB_MAX_OPEN'] = 64
+
+# LLM prompt and SQL template caches live in the instance folder, not the working directory
+monyca.set_cache_dir(app.instance_path)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,14 +54,79 @@ logging.basicConfig(
 # Initialize SQLAlchemy with app
 db.init_app(app)
 
+chat_executor = SingleFlightExecutor(app.config['CHAT_WORKERS'], app.config['CHAT_QUEUE'])
+
+# bodies of repeat reads, valid until the next write bumps the transactions version
+response_cache = http_cache.ResponseCache(max_entries=256)
+
+# users' transactions live in their own database files, see shards.py
+shard_router = ShardRouter(app.config['USER_DB_DIR'], app.config['USER_DB_MAX_OPEN'])
+
+
+def data_session(user_id: Optional[str] = None):
+    """
+    Session for the request's data: the user's own database when a userId is
+    given (argument or ?userId=), the shared database otherwise.
+    Raises ValueError for a malformed userId.
+    """
+    user_id = user_id or request.args.get('userId')
+    if not user_id:
+        return db.session
+    if 'user_sessions' not in g:
+        g.user_sessions = {}
+    if user_id not in g.user_sessions:
+        g.user_sessions[user_id] = shard_router.session(user_id)
+    return g.user_sessions[user_id]
+
+
+def write(user_id: Optional[str], job, exclusive: bool = False):
+    """
+    Run job(session) and commit, returning its result: through the shared
+    database's single writer, or directly on the user's own database file.
+    """
+    if not user_id:
+        return writer.run(job, exclusive)
+    session = data_session(user_id)
+    try:
+        result = job(session)
+        session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+
+
+@app.teardown_appcontext
+def close_user_sessions(exc):
+    for session in g.pop('user_sessions', {}).values():
+        session.close()
+
+
+# listing reads plain rows, not Transaction objects; layouts resolved once,
+# with and without the raw payload (?include=rawPayload)
+LIST_COLUMNS = serialization.columns(DEFAULT_FIELDS)
+serialize_page = serialization.serializer(DEFAULT_FIELDS)
+PAYLOAD_LIST_COLUMNS = serialization.columns(DEFAULT_FIELDS + ['rawPayload'])
+serialize_payload_page = serialization.serializer(DEFAULT_FIELDS + ['rawPayload'])
+
 # THE ONLY ENDPOINT YOU NEED
 @app.route('/transaction', methods=['GET', 'POST'])
+@http_cache.conditional(versioning.transactions, data_session, response_cache)
 def transaction():
-    # get all transactions
+    # list transactions, one keyset page at a time
     if request.method == 'GET':
-        # Get all transactions
-        transactions = Transaction.query.all()
-        return jsonify([t.to_dict() for t in transactions])
+        include = request.args.get('include')
+        if include not in (None, '', 'rawPayload'):
+            return jsonify({'error': 'include must be rawPayload'}), 400
+        columns, serialize = (PAYLOAD_LIST_COLUMNS, serialize_payload_page) if include else (LIST_COLUMNS, serialize_page)
+        try:
+            page, next_cursor = queries.paginate(select(*columns), request.args, data_session())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'transactions': serialize(page),
+            'nextCursor': next_cursor
+        })
     
     # add a new transaction
     elif request.method == 'POST':
@@ -43,80 +136,154 @@ def transaction():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        # Parse dates if provided
-        value_date = None
-        booking_date = None
-        if data.get('valueDate'):
-            try:
-                value_date = datetime.fromisoformat(data['valueDate'].replace('Z', '+00:00'))
-            except:
-                pass
-        
-        if data.get('bookingDate'):
-            try:
-                booking_date = datetime.fromisoformat(data['bookingDate'].replace('Z', '+00:00'))
-            except:
-                pass
+        # Create transaction, in its user's database when it has one
+        try:
+            values = ingest.map_payload(data)
+            values['user_id'] = request.args.get('userId') or values['user_id']
+            data_session(values['user_id'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Create transaction
-        transaction = Transaction(
-            trx_id=data.get('trxId', ''),
-            account_iban=data.get('accountIban'),
-            account_name=data.get('accountName'),
-            account_currency=data.get('accountCurrency'),
-            customer_name=data.get('customerName'),
-            product=data.get('product'),
-            trx_type=data.get('trxType'),
-            booking_type=data.get('bookingType'),
-            value_date=value_date,
-            booking_date=booking_date,
-            direction=data.get('direction', 'OUT'),
-            amount=float(data.get('amount', 0)),
-            currency=data.get('currency', 'EUR'),
-            merchant_name=data.get('merchantName'),
-            merchant_full_text=data.get('merchantFullText'),
-            merchant_phone=data.get('merchantPhone'),
-            merchant_address=data.get('merchantAddress'),
-            merchant_iban=data.get('merchantIban'),
-            card_id_masked=data.get('cardIdMasked'),
-            acquirer_country=data.get('acquirerCountry'),
-            reference_nr=data.get('referenceNr'),
-            raw_payload=json.dumps(data.get('rawPayload')) if data.get('rawPayload') else None
-        )
+        def insert_transaction(session):
+            transaction = Transaction(**values)
+            session.add(transaction)
+            aggregates.apply_insert(session, [transaction])
+            session.flush()
+            return transaction.to_dict(include_payload=True)
         
         try:
-            db.session.add(transaction)
-            db.session.commit()
-            return jsonify(transaction.to_dict()), 201
+            created = write(values['user_id'], insert_transaction)
+            return jsonify(created), 201
+        except IntegrityError:
+            return jsonify({'error': f"A transaction with trxId {values['trx_id']!r} already exists"}), 409
         except Exception as e:
-            db.session.rollback()
             return jsonify({'error': str(e)}), 500
 
+# Insert many transactions at once (JSON array or NDJSON body)
+@app.route('/transaction/bulk', methods=['POST'])
+def bulk_transactions():
+    if request.mimetype == 'application/x-ndjson':
+        items = ingest.parse_ndjson(request.get_data(as_text=True))
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return jsonify({'error': 'Body must be a JSON array or NDJSON'}), 400
+    
+    if not items:
+        return jsonify({'error': 'No data provided'}), 400
+    
+    # with ?userId= every item goes to that user's database, otherwise each to its own userId's
+    user_id = request.args.get('userId')
+    try:
+        data_session(user_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    groups: Dict[Optional[str], List] = {}
+    failures = []
+    for index, item in enumerate(items):
+        item_user_id = item.get('userId') if isinstance(item, dict) else None
+        if user_id:
+            item = dict(item, userId=user_id) if isinstance(item, dict) else item
+        elif item_user_id:
+            try:
+                data_session(item_user_id)
+            except ValueError as e:
+                failures.append({'index': index, 'error': str(e)})
+                continue
+        groups.setdefault(user_id or item_user_id or None, []).append((index, item))
+    
+    inserted = 0
+    for group_user_id, group in groups.items():
+        group_items = [item for _, item in group]
+        group_inserted, group_failures = write(
+            group_user_id, lambda session: ingest.bulk_insert(session, group_items), exclusive=True
+        )
+        inserted += group_inserted
+        failures += [dict(f, index=group[f['index']][0]) for f in group_failures]
+    failures.sort(key=lambda f: f['index'])
+    return jsonify({
+        'inserted': inserted,
+        'failed': len(failures),
+        'errors': failures
+    }), 201 if not failures else 207
+
+# Stream every matching transaction without building the full list in memory
+@app.route('/transaction/export', methods=['GET'])
+@http_cache.conditional(versioning.transactions, data_session)
+def export_transactions():
+    try:
+        fields = export.parse_fields(request.args.get('fields'))
+        # validate filters up front, before the response starts streaming
+        queries.apply_filters(Transaction.query, request.args)
+        session = data_session()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'json'):
+        return jsonify({'error': 'format must be ndjson or json'}), 400
+
+    rows = export.select_rows(session, fields, request.args.to_dict())
+    if fmt == 'ndjson':
+        body, mimetype = export.iter_ndjson(rows, fields), 'application/x-ndjson'
+    else:
+        body, mimetype = export.iter_json_array(rows, fields), 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype)
+
 # DELETE specific transaction by ID
 @app.route('/transaction/<int:transaction_id>', methods=['DELETE'])
 def delete_transaction(transaction_id):
     try:
+        data_session()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def delete(session):
         # Find the transaction by ID
-        transaction = Transaction.query.get(transaction_id)
-        
+        transaction = session.get(Transaction, transaction_id)
         if not transaction:
-            return jsonify({'error': 'Transaction not found'}), 404
+            return False
         
         # Delete the transaction
-        db.session.delete(transaction)
-        db.session.commit()
-        
+        session.delete(transaction)
+        session.flush()
+        aggregates.apply_delete(session, [transaction])
+        return True
+    
+    try:
+        if not write(request.args.get('userId'), delete):
+            return jsonify({'error': 'Transaction not found'}), 404
         return jsonify({'message': 'Transaction deleted successfully'}), 200
         
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+# Precomputed spending totals per month, category or merchant
+@app.route('/api/spending', methods=['GET'])
+@http_cache.conditional(versioning.transactions, data_session, response_cache)
+def spending():
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        rows = aggregates.breakdown(
+            data_session(),
+            request.args.get('by', 'month'),
+            direction=request.args.get('direction', 'OUT'),
+            limit=limit
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify([r.to_dict() for r in rows])
+
+
 # Simple AI Chat Service for Financial Assistant
 class FinancialChatBot:
     """Simple rule-based chatbot for financial assistance"""
     
+    # Intents in the order they take precedence when a message matches several
+    INTENTS = ("greetings", "transactions", "spending", "budget", "savings", "help")
+    
     def __init__(self):
         self.greetings = ["hello", "hi", "hey", "good morning", "good afternoon", "good evening"]
         self.financial_keywords = {
@@ -127,57 +294,95 @@ class FinancialChatBot:
             "transactions": ["transaction", "transactions", "payment", "payments"],
             "analysis": ["analyze", "analysis", "report", "summary", "overview"]
         }
+        
+        # One regex for every keyword, so a message is scanned once. Each keyword
+        # sits in a lookahead to keep the substring semantics of `keyword in message`:
+        # overlapping keywords ("hi" inside "this") all still match.
+        keywords = {"greetings": self.greetings, "help": ["help"]}
+        keywords.update({intent: self.financial_keywords[intent] for intent in self.INTENTS if intent in self.financial_keywords})
+        alternatives = '|'.join(
+            f"(?P<{intent}>{'|'.join(re.escape(k) for k in sorted(keywords[intent], key=len, reverse=True))})"
+            for intent in self.INTENTS
+        )
+        self._matcher = re.compile(f"(?=(?:{alternatives}))")
+        
+        # data-dependent answers, keyed by intent: (data version, answer)
+        self._answers: Dict[str, Any] = {}
+    
+    def match_intent(self, message_lower: str):
+        """Highest-precedence intent whose keywords occur in the message, or None"""
+        found = {m.lastgroup for m in self._matcher.finditer(message_lower)}
+        return next((intent for intent in self.INTENTS if intent in found), None)
+    
+    def _cached(self, intent: str, compute) -> str:
+        """Reuse an answer computed from the database until the next transaction write"""
+        version = versioning.transactions.current(db.session)
+        cached = self._answers.get(intent)
+        if cached and cached[0] == version:
+            return cached[1]
+        answer = compute()
+        self._answers[intent] = (version, answer)
+        return answer
+    
+    def _transactions_answer(self) -> str:
+        transaction_count = aggregates.transaction_count(db.session)
+        if transaction_count > 0:
+            recent_transactions = Transaction.query.order_by(Transaction.booking_date.desc()).limit(5).all()
+            total_spent = sum(t.amount for t in recent_transactions if t.direction == 'OUT')
+            return f"You have {transaction_count} transactions in total. Your last 5 transactions show spending of €{total_spent:.2f}. Would you like me to analyze your spending patterns?"
+        else:
+            return "I don't see any transactions in your account yet. Once you add some transactions, I can help you analyze your spending patterns!"
+    
+    def _spending_answer(self) -> str:
+        count, total_spent, largest = aggregates.totals(db.session, 'OUT')
+        if count:
+            avg_transaction = total_spent / count
+            return f"Based on your transactions, you've spent €{total_spent:.2f} total with an average transaction of €{avg_transaction:.2f}. Your largest expense was €{largest:.2f}."
+        else:
+            return "I don't see any spending transactions yet. Once you add some expenses, I can provide detailed spending analysis!"
     
     def get_response(self, message: str) -> str:
         """Generate AI-like response based on user message"""
         message_lower = message.lower().strip()
+        intent = self.match_intent(message_lower)
         
         # Handle greetings
-        if any(greeting in message_lower for greeting in self.greetings):
+        if intent == "greetings":
             return "Hello! I'm your MoneyBuddy financial assistant. I can help you analyze your spending, track transactions, and provide budgeting advice. What would you like to know about your finances?"
         
         # Handle transaction-related queries
-        if any(keyword in message_lower for keyword in self.financial_keywords["transactions"]):
+        if intent == "transactions":
             try:
-                transaction_count = Transaction.query.count()
-                if transaction_count > 0:
-                    recent_transactions = Transaction.query.order_by(Transaction.booking_date.desc()).limit(5).all()
-                    total_spent = sum(t.amount for t in recent_transactions if t.direction == 'OUT')
-                    return f"You have {transaction_count} transactions in total. Your last 5 transactions show spending of €{total_spent:.2f}. Would you like me to analyze your spending patterns?"
-                else:
-                    return "I don't see any transactions in your account yet. Once you add some transactions, I can help you analyze your spending patterns!"
+                return self._cached(intent, self._transactions_answer)
             except Exception:
                 return "I can help you manage your transactions. Try adding some transactions first, and I'll provide insights about your spending!"
         
         # Handle spending analysis
-        if any(keyword in message_lower for keyword in self.financial_keywords["spending"]):
+        if intent == "spending":
             try:
-                outgoing_transactions = Transaction.query.filter_by(direction='OUT').all()
-                if outgoing_transactions:
-                    total_spent = sum(t.amount for t in outgoing_transactions)
-                    avg_transaction = total_spent / len(outgoing_transactions)
-                    return f"Based on your transactions, you've spent €{total_spent:.2f} total with an average transaction of €{avg_transaction:.2f}. Your largest expense was €{max(t.amount for t in outgoing_transactions):.2f}."
-                else:
-                    return "I don't see any spending transactions yet. Once you add some expenses, I can provide detailed spending analysis!"
+                return self._cached(intent, self._spending_answer)
             except Exception:
                 return "I can analyze your spending patterns once you have some transaction data. Would you like to add some transactions first?"
         
         # Handle budget advice
-        if any(keyword in message_lower for keyword in self.financial_keywords["budget"]):
+        if intent == "budget":
             return "Here are some budgeting tips: 1) Track all expenses, 2) Set spending limits for categories, 3) Review your transactions weekly, 4) Save at least 20% of income, 5) Plan for unexpected expenses. Would you like specific advice based on your spending data?"
         
         # Handle savings questions
-        if any(keyword in message_lower for keyword in self.financial_keywords["savings"]):
+        if intent == "savings":
             return "Great question about savings! I recommend the 50/30/20 rule: 50% for needs, 30% for wants, 20% for savings. Based on your transaction history, I can help identify areas where you could save more. What's your current savings goal?"
         
         # Handle help requests
-        if "help" in message_lower:
+        if intent == "help":
             return "I can help you with: \n• Analyzing your spending patterns\n• Tracking transactions\n• Budgeting advice\n• Savings recommendations\n• Financial insights\n\nJust ask me something like 'How much did I spend?' or 'Give me budgeting tips!'"
         
         # Default helpful response
         return "I'm your MoneyBuddy assistant! I can help analyze your finances, track spending, and provide budgeting advice. Try asking me about your transactions, spending patterns, or financial goals. What would you like to know?"
 
 
+# Built once: the keyword matcher is compiled in the constructor
+chatbot = FinancialChatBot()
+
 # Chat endpoint
 @app.route('/api/chat', methods=['POST'])
 def chat():
@@ -220,8 +425,7 @@ def chat():
         # Log the incoming request (with 🚀 as specified)
         app.logger.info(f"🚀 Chat Request - Message: {user_message[:100]}... Timestamp: {timestamp}")
         
-        # Initialize chatbot and get response
-        chatbot = FinancialChatBot()
+        # Get response from the shared chatbot
         ai_response = chatbot.get_response(user_message)
         
         # Prepare response
@@ -250,6 +454,53 @@ def chat():
         }), 500
 
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Chat through the full finance pipeline (question -> SQL -> answer), streamed as Server-Sent Events.
+    Same body as /api/chat. Events: status ({"stage": ...}), token ({"text": ...}), done or error.
+    Runs on a bounded worker pool: 429 with Retry-After when it is full.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('message'), str) or not data['message'].strip():
+        return jsonify({'error': 'Message field is required and cannot be empty'}), 400
+    user_message = data['message'].strip()
+    app.logger.info(f"🚀 Chat Stream Request - Message: {user_message[:100]}...")
+
+    # identical questions against the same data share one upstream run
+    key = (' '.join(user_message.lower().split()), versioning.transactions.current(db.session))
+    try:
+        flight, joined = chat_executor.submit(key, lambda: finance_manager.stream_query(user_message))
+    except Overloaded:
+        app.logger.warning("Chat stream rejected: executor queue is full")
+        response = jsonify({'error': 'Too many chat requests in progress, please retry shortly'})
+        response.headers['Retry-After'] = str(app.config['CHAT_RETRY_AFTER'])
+        return response, 429
+
+    def generate():
+        length = 0
+        # sent before the job gets a worker, so the client hears back at once even when queued
+        yield sse_event('status', {'stage': 'joined' if joined else 'accepted'})
+        for event, payload in flight:
+            if event == 'error':
+                app.logger.error(f"❌ Chat stream error: {payload['error']}")
+                yield sse_event('error', {'error': "Sorry, I'm having trouble connecting right now. Please try again."})
+                return
+            if event == 'token':
+                length += len(payload['text'])
+            yield sse_event(event, payload)
+        yield sse_event('done', {'timestamp': datetime.utcnow().isoformat() + 'Z'})
+        app.logger.info(f"✅ Chat Stream Response - Length: {length} chars")
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 # Root endpoint - API documentation
 @app.route('/', methods=['GET'])
 def root():
@@ -261,8 +512,13 @@ def root():
             '/': 'API documentation (this endpoint)',
             '/api': 'API info',
             '/api/chat': 'POST - Chat with AI financial assistant',
+            '/api/chat/stream': 'POST - Chat answered from your transactions, streamed as Server-Sent Events',
             '/api/health': 'GET - Health check',
-            '/transaction': 'GET/POST - Transaction management',
+            '/api/spending': 'GET - Spending totals (by=month|category|merchant|total, direction, limit)',
+            '/transaction': 'GET/POST - Transaction management (GET is paginated: limit, cursor, dateFrom, dateTo, direction, currency, merchant, customer, minAmount, maxAmount; include=rawPayload adds the source record)',
+            'userId': 'Query parameter accepted by every /transaction* endpoint and /api/spending: read and write that user\'s own database',
+            '/transaction/bulk': 'POST - Insert many transactions (JSON array or NDJSON body), per-item errors reported',
+            '/transaction/export': 'GET - Stream transactions (format=ndjson|json, fields=comma separated projection, rawPayload only when listed, same filters as GET /transaction)',
             '/transaction/<id>': 'DELETE - Delete specific transaction'
         },
         'chat_example': {
@@ -286,6 +542,7 @@ def api_info():
         'timestamp': datetime.utcnow().isoformat() + 'Z',
         'available_endpoints': [
             {'path': '/api/chat', 'method': 'POST', 'description': 'Chat with AI assistant'},
+            {'path': '/api/chat/stream', 'method': 'POST', 'description': 'Streaming chat over your transactions (SSE)'},
             {'path': '/api/health', 'method': 'GET', 'description': 'Health check'},
             {'path': '/transaction', 'method': 'GET/POST', 'description': 'Transaction management'}
         ]
@@ -298,12 +555,26 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat() + 'Z',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'chat': chat_executor.stats(),
+        'responseCache': response_cache.stats(),
+        'resultCache': monyca.query_result_cache.stats(),
+        'promptCache': monyca.get_prompt_cache().stats(),
+        'userDatabases': shard_router.stats(),
+        'writer': writer.stats()
     }), 200
 
-# Create database tables
+# Create database tables and bring existing ones up to date
 with app.app_context():
+    # WAL and the other pragmas, before the first connection is opened
+    storage.configure(db.engine)
     db.create_all()
+    migrations.upgrade(db.engine)
+    aggregates.ensure_built(db.session)
+    # the LLM pipeline reads the same database file through its own read-only pool
+    finance_manager = monyca.FinanceManager(db.engine.url.database)
+    # every write to the shared database goes through this one connection and thread
+    writer = storage.Writer(storage.write_engine(db.engine.url))
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=420)
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+Benchmark the transaction listing read path: ORM objects + to_dict() vs plain rows + serialization
+
+Both paths stream the table in pages (ordered like GET /transaction) and must
+produce identical dicts; the script checks that before timing them.
+
+Usage:
+    python bench_listing.py [--db instance/transactions.db] [--rows 50000] [--page-size 1000]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from models import db, DEFAULT_FIELDS, Transaction
+import ingest
+import serialization
+
+
+def fill(engine, n: int) -> None:
+    """Insert n synthetic transactions with payloads shaped like the Excel import's"""
+    rng = random.Random(0)
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(n):
+        booked = start + timedelta(minutes=rng.randrange(600_000), microseconds=rng.choice([0, rng.randrange(1_000_000)]))
+        merchant = rng.choice(['Migros', 'Coop', 'SBB', 'Denner', 'Galaxus', 'Starbucks'])
+        amount = round(rng.uniform(1, 300), 2)
+        rows.append({
+            'trx_id': f'T{i}', 'account_iban': 'CH9300762011623852957', 'account_name': 'Privatkonto',
+            'account_currency': 'CHF', 'customer_name': 'mario', 'product': 'Debit Card', 'trx_type': 'debit',
+            'booking_type': 'Card payment', 'value_date': booked, 'booking_date': booked, 'direction': 'OUT',
+            'amount': amount, 'currency': 'CHF', 'merchant_name': merchant,
+            'merchant_full_text': f'{merchant} ZURICH', 'merchant_address': 'Bahnhofstrasse 1, 8001 Zurich',
+            'card_id_masked': '****1234', 'acquirer_country': 'CH', 'reference_nr': f'R{i}',
+            'raw_payload': json.dumps({'TRX_ID': f'T{i}', 'POINT_OF_SALE_AND_LOCATION': merchant, 'AMOUNT': amount,
+                                       'TRX_DATE': booked.isoformat(), 'CARD_ID': '****1234'}),
+            'created_at': start, 'updated_at': start,
+        })
+    with engine.begin() as conn:
+        ingest.insert_rows(conn, rows)
+
+
+ORDER = (Transaction.booking_date.desc(), Transaction.id.desc())
+
+
+def orm_pages(session, page_size: int):
+    stmt = select(Transaction).order_by(*ORDER).execution_options(yield_per=page_size)
+    for page in session.scalars(stmt).partitions():
+        yield [t.to_dict() for t in page]
+
+
+def core_pages(session, page_size: int):
+    fields = list(DEFAULT_FIELDS)
+    stmt = select(*serialization.columns(fields)).order_by(*ORDER).execution_options(yield_per=page_size)
+    serialize = serialization.serializer(fields)
+    for page in session.execute(stmt).partitions():
+        yield serialize(page)
+
+
+def measure(pages) -> float:
+    started = time.perf_counter()
+    count = sum(len(page) for page in pages)
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare rows/s of the ORM and the core listing read paths")
+    parser.add_argument('--db', help="Existing transactions database (default: a temporary one with --rows rows)")
+    parser.add_argument('--rows', type=int, default=50000, help="Synthetic rows to generate when --db is not given")
+    parser.add_argument('--page-size', type=int, default=1000, help="Rows per page")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine(f"sqlite:///{path}")
+    if not args.db:
+        db.metadata.create_all(engine)
+        fill(engine, args.rows)
+
+    with Session(engine) as session:
+        if next(orm_pages(session, 500), []) != next(core_pages(session, 500), []):
+            raise SystemExit("The two read paths disagree on the first page")
+        session.rollback()
+        # warm the page cache so both runs read from memory
+        measure(core_pages(session, args.page_size))
+        orm = measure(orm_pages(session, args.page_size))
+        core = measure(core_pages(session, args.page_size))
+
+    print(f"ORM + to_dict():      {orm:10.0f} rows/s")
+    print(f"core + serialization: {core:10.0f} rows/s  ({core / orm:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
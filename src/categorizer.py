@@ -0,0 +1,168 @@
+"""
+Local first-pass merchant categorizer
+
+Matches merchants against already categorized ones and a user-editable
+rules table before anything is sent to the LLM. Everything is in memory:
+the index is built once from the database and extended with add() as new
+categories come in.
+
+Matching tiers, most to least certain:
+  1. rules (category_rules.pattern found in the merchant name or full text)
+  2. exact match of the normalized merchant name
+  3. token votes: the categories of known merchants sharing name tokens
+  4. character trigram similarity to a known merchant name
+"""
+import math
+import re
+import sqlite3
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+DEFAULT_THRESHOLD = 0.8
+# Known names compared with an unseen one at most, on the trigram tier
+MAX_CANDIDATES = 32
+
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+# Tokens that say nothing about what a merchant sells
+_NOISE = frozenset({'the', 'and', 'gmbh', 'ag', 'sa', 'sarl', 'ltd', 'srl', 'spa', 'inc', 'www', 'com', 'shop', 'store'})
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lowercase, punctuation to spaces, collapsed whitespace"""
+    return ' '.join(_NON_WORD.sub(' ', text.lower()).split()) if text else ''
+
+
+def tokens(normalized: str) -> List[str]:
+    return [t for t in normalized.split() if len(t) > 2 and not t.isdigit() and t not in _NOISE]
+
+
+def trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class LocalCategorizer:
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._exact: Dict[str, str] = {}
+        self._token_votes: Dict[str, Counter] = defaultdict(Counter)
+        self._trigram_index: Dict[str, Set[str]] = defaultdict(set)
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._rules: List[Tuple[str, str]] = []
+        self._rule_matcher = None
+
+    @classmethod
+    def from_connection(cls, conn: sqlite3.Connection, threshold: float = DEFAULT_THRESHOLD) -> 'LocalCategorizer':
+        """Build the index from merchant_categories and category_rules"""
+        categorizer = cls(threshold)
+        conn.execute("CREATE TABLE IF NOT EXISTS category_rules (pattern TEXT PRIMARY KEY, category TEXT NOT NULL)")
+        categorizer.set_rules(conn.execute("SELECT pattern, category FROM category_rules"))
+        for merchant_name, category in conn.execute("SELECT merchant_name, category FROM merchant_categories"):
+            categorizer.add(merchant_name, category)
+        return categorizer
+
+    def set_rules(self, rules: Iterable[Tuple[str, str]]) -> None:
+        """Compile (pattern, category) rules into one regex; longer patterns win over shorter ones"""
+        self._rules = sorted(((normalize(p), c) for p, c in rules if normalize(p)), key=lambda r: -len(r[0]))
+        if self._rules:
+            self._rule_matcher = re.compile(
+                '|'.join(f"(?P<r{i}>\\b{re.escape(pattern)}\\b)" for i, (pattern, _) in enumerate(self._rules))
+            )
+        else:
+            self._rule_matcher = None
+
+    def add(self, merchant_name: str, category: str) -> None:
+        """Index one categorized merchant"""
+        name = normalize(merchant_name)
+        if not name or name in self._exact:
+            return
+        self._exact[name] = category
+        for token in set(tokens(name)):
+            self._token_votes[token][category] += 1
+        self._trigrams[name] = trigrams(name)
+        for gram in self._trigrams[name]:
+            self._trigram_index[gram].add(name)
+
+    def categorize(self, merchant_name: str, full_text: Optional[str] = None) -> Tuple[Optional[str], float]:
+        """Best local guess as (category, confidence); (None, 0.0) when nothing matches"""
+        name = normalize(merchant_name)
+        if self._rule_matcher is not None:
+            match = self._rule_matcher.search(name) or (full_text and self._rule_matcher.search(normalize(full_text)))
+            if match:
+                return self._rules[int(match.lastgroup[1:])][1], 1.0
+
+        if name in self._exact:
+            return self._exact[name], 1.0
+
+        category, confidence = self._vote(tokens(name))
+        if confidence >= self.threshold:
+            return category, confidence
+        return self._nearest(name) if name else (None, 0.0)
+
+    def _vote(self, name_tokens: List[str]) -> Tuple[Optional[str], float]:
+        """
+        Each known token votes with the category distribution of the merchants
+        containing it, weighted by the square of its purity (the share of its
+        majority category), so generic tokens like city names barely count.
+        The confidence is the winner's share of the weighted votes.
+        """
+        scores = Counter()
+        weight = 0.0
+        for token in name_tokens:
+            votes = self._token_votes.get(token)
+            if not votes:
+                continue
+            total = sum(votes.values())
+            purity = max(votes.values()) / total
+            token_weight = purity * purity
+            weight += token_weight
+            for category, count in votes.items():
+                scores[category] += token_weight * count / total
+        if not scores:
+            return None, 0.0
+        category, score = scores.most_common(1)[0]
+        return category, score / weight
+
+    def _nearest(self, name: str) -> Tuple[Optional[str], float]:
+        """
+        Known name with the highest Jaccard similarity of character trigrams,
+        searched only as far as the threshold needs. A name at least as
+        similar as the threshold shares one of the query's
+        len - ceil(threshold * len) + 1 rarest trigrams and has a trigram count
+        within [threshold * len, len / threshold], so only those postings and
+        lengths are checked, and at most MAX_CANDIDATES of them. Below the
+        threshold the returned score is a lower bound, which is all split() needs.
+        """
+        grams = trigrams(name)
+        size = len(grams)
+        prefix = size - math.ceil(self.threshold * size) + 1
+        postings = sorted((self._trigram_index.get(g, ()) for g in grams), key=len)[:max(prefix, 1)]
+        low, high = self.threshold * size, size / self.threshold if self.threshold else float('inf')
+
+        best, best_score, checked = None, 0.0, set()
+        for posting in postings:
+            for candidate in posting:
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                other = self._trigrams[candidate]
+                if not low <= len(other) <= high:
+                    continue
+                shared = len(grams & other)
+                score = shared / (size + len(other) - shared)
+                if score > best_score:
+                    best, best_score = candidate, score
+                if len(checked) >= MAX_CANDIDATES:
+                    return (self._exact[best], best_score) if best else (None, 0.0)
+        return (self._exact[best], best_score) if best else (None, 0.0)
+
+    def split(self, merchants: Iterable[Tuple[str, Optional[str]]]) -> Tuple[Dict[str, str], List[str]]:
+        """Partition (merchant_name, full_text) pairs into confident local matches and the rest"""
+        matched, unmatched = {}, []
+        for merchant_name, full_text in merchants:
+            category, confidence = self.categorize(merchant_name, full_text)
+            if category is not None and confidence >= self.threshold:
+                matched[merchant_name] = category
+            else:
+                unmatched.append(merchant_name)
+        return matched, unmatched
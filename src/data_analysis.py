@@ -1,129 +1,220 @@
-#%%
+"""
+Synthetic multi-user transaction datasets for demos and load testing
+
+Template rows are sampled from an existing transactions database and given
+random users, dates and amount variance, plus a trx_id of their own (the
+template's with the row number appended). Generation is vectorized with a
+seeded NumPy generator and streamed to SQLite in chunks, so datasets of
+millions of rows are reproducible and fit in constant memory. The target gets
+the app's schema (keys, indexes, aggregates); raw payloads are not copied.
+
+Usage:
+    python data_analysis.py instance/transactions.db instance/synthetic_transactions.db \
+        --rows 1200 --users 10 --seed 42 [--chunk-size 100000] [--date-range 2024-09-21 2025-09-21]
+"""
+import argparse
 import sqlite3
-import pandas as pd
-import random
+import uuid
 from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
 import numpy as np
-import re
-import json
-import requests
-from typing import Dict, List, Tuple, Optional
-from collections import Counter
-import uuid
+import pandas as pd
+from sqlalchemy import create_engine
+
+from models import db, Transaction
+import aggregates
+import migrations
+
+CUSTOMER_NAMES = ["franco", "peppe", "gianni", "luigi", "mario", "pino", "spongebob", "skuz", "dema", "gandi"]
+
+# Date columns overwritten on the synthetic rows, when the template has them
+DATE_COLUMNS = {
+    'date': '%Y-%m-%d',
+    'timestamp': '%Y-%m-%dT%H:%M:%S',
+    'booking_date': '%Y-%m-%d %H:%M:%S.%f',
+    'value_date': '%Y-%m-%d %H:%M:%S.%f',
+}
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+
+def generate_synthetic_users(rng: np.random.Generator, num_users: int):
+    """Random (but seed-reproducible) user ids and a customer name for each"""
+    user_ids = [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(num_users)]
+    names = [
+        CUSTOMER_NAMES[i] if i < len(CUSTOMER_NAMES) else f"{CUSTOMER_NAMES[i % len(CUSTOMER_NAMES)]}{i // len(CUSTOMER_NAMES)}"
+        for i in range(num_users)
+    ]
+    return np.array(user_ids, dtype=object), np.array(names, dtype=object)
+
+
+def iter_synthetic_transactions(original_df: pd.DataFrame, num_users: int = 10, total_transactions: int = 1200,
+                                seed: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                months: int = 12, now: Optional[datetime] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield synthetic transactions in chunks of at most chunk_size rows.
+
+    Rows are spread evenly over the last `months` months (a random day 1-28 in
+    each), assigned to one of `num_users` random users and get ±20% amount
+    variance. The same seed always produces the same rows.
+    """
+    rng = np.random.default_rng(seed)
+    user_ids, customer_names = generate_synthetic_users(rng, num_users)
+    now = now or datetime.now()
+    month_starts = np.array(
+        [np.datetime64((now - timedelta(days=30 * (months - 1 - m))).replace(day=1).date()) for m in range(months)]
+    )
+
+    for start in range(0, total_transactions, chunk_size):
+        size = min(chunk_size, total_transactions - start)
+        chunk = original_df.iloc[rng.integers(0, len(original_df), size)].reset_index(drop=True)
+
+        # template trx_ids repeat; the row number makes every synthetic one unique
+        numbers = pd.Series(np.arange(start, start + size)).astype(str)
+        template_ids = chunk['trx_id'].fillna('').astype(str) if 'trx_id' in chunk.columns else 'S'
+        chunk['trx_id'] = template_ids + '-' + numbers
+
+        users = rng.integers(0, num_users, size)
+        chunk['user_id'] = user_ids[users]
+        if 'customer_name' in chunk.columns:
+            chunk['customer_name'] = customer_names[users]
+
+        # rows are laid out in month order, like the original one-month-at-a-time loop
+        month = (np.arange(start, start + size) * months) // total_transactions
+        dates = pd.Series(month_starts[month] + rng.integers(0, 28, size).astype('timedelta64[D]'))
+        for column, fmt in DATE_COLUMNS.items():
+            if column in chunk.columns:
+                chunk[column] = dates.dt.strftime(fmt)
 
-# Connect to the transaction database
-conn = sqlite3.connect('/Users/alessiogandelli/dev/starthacktoursept25/moneybuddy-backend/instance/transactions.db')
+        if 'amount' in chunk.columns:
+            chunk['amount'] = pd.to_numeric(chunk['amount'], errors='coerce').to_numpy() * rng.uniform(0.8, 1.2, size)
 
+        yield chunk
 
-df = pd.read_sql('SELECT * FROM transactions', conn)
 
+def generate_synthetic_transactions(original_df: pd.DataFrame, num_users: int = 10, total_transactions: int = 1200,
+                                    seed: Optional[int] = None) -> pd.DataFrame:
+    """Generate synthetic transactions based on existing data patterns, as one DataFrame"""
+    return pd.concat(
+        iter_synthetic_transactions(original_df, num_users, total_transactions, seed, chunk_size=max(total_transactions, 1)),
+        ignore_index=True
+    )
 
 
-# Close the connection
-conn.close()
-# %%
+def write_synthetic_db(source_db: str, target_db: str, num_users: int = 10, total_transactions: int = 1200,
+                       seed: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Stream a synthetic dataset built from source_db's transactions into target_db"""
+    with sqlite3.connect(source_db) as conn:
+        original_df = pd.read_sql('SELECT * FROM transactions', conn)
+    if original_df.empty:
+        raise ValueError(f"No template transactions in {source_db}")
+    # template ids would collide (the target assigns its own), other columns must exist in the schema
+    columns = {c.name for c in Transaction.__table__.columns} - {'id'}
+    original_df = original_df[[c for c in original_df.columns if c in columns]]
 
-# %%
-def generate_synthetic_user_id():
-    """Generate a random user ID"""
-    return str(uuid.uuid4())
+    # (re)create the target with the app's tables, indexes and data version row
+    engine = create_engine(f"sqlite:///{target_db}")
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    migrations.upgrade(engine)
+    engine.dispose()
 
-def generate_synthetic_transactions(original_df: pd.DataFrame, num_users: int = 10, total_transactions: int = 1200) -> pd.DataFrame:
+    written = 0
+    synthetic_conn = sqlite3.connect(target_db)
+    try:
+        for chunk in iter_synthetic_transactions(original_df, num_users, total_transactions, seed, chunk_size):
+            chunk.to_sql('transactions', synthetic_conn, if_exists='append', index=False)
+            synthetic_conn.commit()
+            written += len(chunk)
+            print(f"Wrote {written}/{total_transactions} synthetic transactions")
+        with synthetic_conn:
+            for sql in aggregates.REBUILD_SQL:
+                synthetic_conn.execute(sql)
+    finally:
+        synthetic_conn.close()
+    return written
+
+
+def update_dates_in_synthetic_db(db_path: str, start_date: datetime = datetime(2024, 9, 21),
+                                 end_date: datetime = datetime(2025, 9, 21), seed: Optional[int] = None,
+                                 batch_size: int = DEFAULT_CHUNK_SIZE) -> int:
     """
-    Generate synthetic transactions based on existing data patterns
+    Spread the transaction dates uniformly between start_date and end_date, in place.
+
+    New dates are drawn in vectorized batches, loaded into a temporary rowid ->
+    date table and applied with one UPDATE ... FROM per batch, so the table keeps
+    its schema, indexes and column types. Returns the number of rows updated.
     """
-    synthetic_data = []
-    user_ids = [generate_synthetic_user_id() for _ in range(num_users)]
-    customer_names = ["franco", "peppe", "gianni", "luigi", "mario", "pino", "spongebob", "skuz", "dema", "gandi"]
-    
-    # Create user mapping
-    user_customer_mapping = dict(zip(user_ids, customer_names))
-    
-    # Calculate transactions per month (should be 100)
-    transactions_per_month = total_transactions // 12
-    
-    for month_offset in range(12):  # Last 12 months
-        for _ in range(transactions_per_month):
-            # Select a random row from original data as template
-            template_row = original_df.sample(n=1).iloc[0]
-            
-            # Generate random date within the month
-            base_date = datetime.now() - timedelta(days=30 * (11 - month_offset))
-            random_day = random.randint(1, 28)  # Safe day range for all months
-            transaction_date = base_date.replace(day=random_day)
-            
-            # Create new transaction with random user
-            new_transaction = template_row.copy()
-            selected_user_id = random.choice(user_ids)
-            new_transaction['user_id'] = selected_user_id
-            
-            # Set customer_name based on user_id
-            if 'customer_name' in original_df.columns:
-                new_transaction['customer_name'] = user_customer_mapping[selected_user_id]
-            
-            # Update date fields if they exist
-            if 'date' in original_df.columns:
-                new_transaction['date'] = transaction_date.strftime('%Y-%m-%d')
-            if 'timestamp' in original_df.columns:
-                new_transaction['timestamp'] = transaction_date.isoformat()
-            
-            # Add some variance to amount if it exists
-            if 'amount' in original_df.columns:
-                variance = random.uniform(0.8, 1.2)  # ±20% variance
-                new_transaction['amount'] = float(template_row['amount']) * variance
-            
-            synthetic_data.append(new_transaction)
-    
-    return pd.DataFrame(synthetic_data)
-
-# Generate synthetic data
-print("Generating synthetic transactions...")
-synthetic_df = generate_synthetic_transactions(df, num_users=10, total_transactions=1200)
-
-# Create new database with synthetic data
-synthetic_conn = sqlite3.connect('/Users/alessiogandelli/dev/starthacktoursept25/moneybuddy-backend/instance/synthetic_transactions.db')
-
-# Write synthetic data to new database
-synthetic_df.to_sql('transactions', synthetic_conn, if_exists='replace', index=False)
-
-print(f"Created synthetic database with {len(synthetic_df)} transactions")
-print(f"Number of unique users: {synthetic_df['user_id'].nunique()}")
-print(f"Date range: {synthetic_df.get('date', pd.Series()).min()} to {synthetic_df.get('date', pd.Series()).max()}")
-
-# Close the connection
-synthetic_conn.close()
-# Update dates to be from Sept 21, 2024 to Sept 21, 2025
-def update_dates_in_synthetic_db():
-    """Update dates in synthetic database to range from Sept 21, 2024 to Sept 21, 2025"""
-    conn = sqlite3.connect('/Users/alessiogandelli/dev/starthacktoursept25/moneybuddy-backend/instance/synthetic_transactions.db')
-    
-    # Read the synthetic data
-    df = pd.read_sql('SELECT * FROM transactions', conn)
-    
-    # Generate new dates within the specified range
-    start_date = datetime(2024, 9, 21)
-    end_date = datetime(2025, 9, 21)
+    rng = np.random.default_rng(seed)
     date_range = (end_date - start_date).days
-    
-    for idx in range(len(df)):
-        # Generate random date within range
-        random_days = random.randint(0, date_range)
-        new_date = start_date + timedelta(days=random_days)
-        
-        # Update date fields
-        if 'date' in df.columns:
-            df.loc[idx, 'date'] = new_date.strftime('%Y-%m-%d')
-        if 'timestamp' in df.columns:
-            df.loc[idx, 'timestamp'] = new_date.isoformat()
-    
-    # Write updated data back to database
-    df.to_sql('transactions', conn, if_exists='replace', index=False)
-    
-    print(f"Updated dates to range from {df.get('date', pd.Series()).min()} to {df.get('date', pd.Series()).max()}")
-    
-    conn.close()
-
-# Update the dates
-update_dates_in_synthetic_db()
-
-# %%
+    conn = sqlite3.connect(db_path)
+    try:
+        # the index entries for the rewritten dates land all over the b-tree; keep them in cache
+        conn.execute("PRAGMA cache_size = -262144")
+        table_columns = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+        columns = [c for c in DATE_COLUMNS if c in table_columns]
+        if not columns:
+            return 0
+
+        conn.execute(f"CREATE TEMP TABLE date_map (rid INTEGER PRIMARY KEY, {', '.join(columns)})")
+        insert_sql = f"INSERT INTO date_map VALUES (?{', ?' * len(columns)})"
+        update_sql = (f"UPDATE transactions SET {', '.join(f'{c} = date_map.{c}' for c in columns)} "
+                      f"FROM date_map WHERE transactions.rowid = date_map.rid AND transactions.rowid BETWEEN ? AND ?")
+
+        updated = 0
+        last_rowid = -1
+        while True:
+            rowids = [r[0] for r in conn.execute(
+                "SELECT rowid FROM transactions WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size)
+            )]
+            if not rowids:
+                break
+            new_dates = pd.Series(np.datetime64(start_date.date()) + rng.integers(0, date_range + 1, len(rowids)).astype('timedelta64[D]'))
+            values = [new_dates.dt.strftime(DATE_COLUMNS[c]).tolist() for c in columns]
+            conn.executemany(insert_sql, zip(rowids, *values))
+            # the rowid range keeps the planner from scanning the whole table for each batch
+            conn.execute(update_sql, (rowids[0], rowids[-1]))
+            conn.execute("DELETE FROM date_map")
+            updated += len(rowids)
+            last_rowid = rowids[-1]
+        conn.execute("DROP TABLE date_map")
+        if 'booking_date' in columns:
+            # month totals follow the new dates
+            for sql in aggregates.REBUILD_SQL:
+                conn.execute(sql)
+        conn.commit()
+
+        first, last = conn.execute(f"SELECT MIN({columns[0]}), MAX({columns[0]}) FROM transactions").fetchone()
+        print(f"Updated dates to range from {first} to {last}")
+        return updated
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic multi-user transactions database")
+    parser.add_argument('source_db', help="Database whose transactions are used as templates")
+    parser.add_argument('target_db', help="Database to (re)create with the synthetic transactions")
+    parser.add_argument('--rows', type=int, default=1200, help="Number of transactions to generate")
+    parser.add_argument('--users', type=int, default=10, help="Number of synthetic users")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed for reproducible datasets")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows generated and written per batch")
+    parser.add_argument('--date-range', nargs=2, metavar=('START', 'END'), type=datetime.fromisoformat,
+                        help="Afterwards spread all dates uniformly between these ISO dates (e.g. 2024-09-21 2025-09-21)")
+    parser.add_argument('--dates-only', action='store_true',
+                        help="Skip generation and only redistribute the dates of an existing target_db")
+    args = parser.parse_args()
+
+    if not args.dates_only:
+        print("Generating synthetic transactions...")
+        written = write_synthetic_db(args.source_db, args.target_db, args.users, args.rows, args.seed, args.chunk_size)
+        print(f"Created synthetic database with {written} transactions")
+
+    if args.date_range or args.dates_only:
+        start_date, end_date = args.date_range or (datetime(2024, 9, 21), datetime(2025, 9, 21))
+        update_dates_in_synthetic_db(args.target_db, start_date, end_date, args.seed, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
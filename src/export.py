@@ -0,0 +1,63 @@
+"""Streaming transaction export with column projection"""
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import select
+
+from models import API_FIELDS, DEFAULT_FIELDS, Transaction
+import queries
+import serialization
+
+# Rows fetched from the database cursor per round trip
+BATCH_SIZE = 1000
+
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    """Validate a comma separated fields= projection (default: every field but rawPayload)"""
+    if not value:
+        return list(DEFAULT_FIELDS)
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    if not fields:
+        raise ValueError("fields must name at least one field")
+    unknown = [f for f in fields if f not in API_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def batches(rows: Iterable[tuple], size: int = BATCH_SIZE) -> Iterator[List[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def select_rows(session, fields: List[str], args: Dict[str, Any]) -> Iterator[tuple]:
+    """Yield projected, filtered rows in id order from a server-side cursor in batches"""
+    stmt = select(*serialization.columns(fields))
+    stmt = queries.apply_filters(stmt, args)
+    stmt = stmt.order_by(Transaction.id).execution_options(yield_per=BATCH_SIZE)
+    for partition in session.execute(stmt).partitions():
+        yield from partition
+
+
+def iter_ndjson(rows: Iterable[tuple], fields: List[str]) -> Iterator[str]:
+    """One JSON document per line, emitted one batch of lines at a time"""
+    serialize = serialization.serializer(fields)
+    for batch in batches(rows):
+        yield '\n'.join(map(json.dumps, serialize(batch))) + '\n'
+
+
+def iter_json_array(rows: Iterable[tuple], fields: List[str]) -> Iterator[str]:
+    """A single JSON array, written incrementally"""
+    serialize = serialization.serializer(fields)
+    yield '['
+    first = True
+    for batch in batches(rows):
+        yield ('' if first else ',') + ','.join(map(json.dumps, serialize(batch)))
+        first = False
+    yield ']'
@@ -0,0 +1,115 @@
+"""
+Conditional GET and in-process response caching for read endpoints
+
+Responses carry a strong ETag built from the data version (see
+versioning.py), read from the request's database, the request path and its
+query string, plus Last-Modified from the version's last bump. Since the
+version lives in the database, a write made by another worker process or
+tool changes it too. A matching If-None-Match is answered with 304 before
+the view runs, and bodies of repeat reads are served from a small LRU keyed
+on (path, params, version). If-Modified-Since is not honoured: its
+one-second resolution cannot tell apart two writes within the same second.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import Response, make_response, request
+
+from versioning import DataVersion, Version
+
+
+class ResponseCache:
+    """LRU of (status, body, mimetype) keyed on (path, params, version)"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Tuple, Tuple[int, bytes, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[Tuple[int, bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, entry: Tuple[int, bytes, str]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries)
+        }
+
+
+def request_key() -> Tuple[str, Tuple]:
+    """The path and the query parameters in a canonical order"""
+    return request.path, tuple(sorted(request.args.items(multi=True)))
+
+
+def make_etag(version: Version, key: Tuple) -> str:
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    return f"{version.epoch}-{version.value}-{digest}"
+
+
+def conditional(version: DataVersion, session: Callable[[], Any], cache: Optional[ResponseCache] = None) -> Callable:
+    """
+    Decorate a view so its GET responses are validated against `version`,
+    read through session() (the request's database session).
+
+    Successful responses get ETag and Last-Modified; with a cache their
+    bodies are also kept for the current version. Streamed responses are
+    validated but never stored. Other methods pass straight through.
+    """
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            try:
+                current = version.current(session())
+            except ValueError:
+                # e.g. an invalid userId, which the view answers itself
+                return view(*args, **kwargs)
+            key = request_key()
+            etag = make_etag(current, key)
+
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                entry = cache.get(key + (current,)) if cache is not None else None
+                if entry is not None:
+                    status, body, mimetype = entry
+                    response = Response(body, status=status, mimetype=mimetype)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if cache is not None and not response.is_streamed and version.current(session()) == current:
+                        cache.put(key + (current,), (response.status_code, response.get_data(), response.mimetype))
+
+            response.set_etag(etag)
+            response.last_modified = current.changed_at
+            # clients may keep the body but must revalidate before using it
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
@@ -1,19 +1,37 @@
-#%%
-import pandas as pd
-import sqlite3
-import json
+"""
+Import the bank's Excel transaction export into the transactions table
+
+The workbook is streamed with openpyxl in read-only mode and converted and
+written chunk by chunk, so memory use does not grow with the file size.
+
+Imports are idempotent: rows are matched on trx_id (or, without one, on a
+hash of their mapped columns). Known unchanged rows are skipped, changed
+ones updated in place, and only unseen rows are inserted, so re-importing
+an overlapping daily dump costs about as much as its new rows.
 
+Usage:
+    python import_data.py data/transactions.xlsx instance/transactions.db [--sheet "TRX Data"] [--chunk-size 5000]
+"""
+import argparse
+import time
 from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import and_, column, create_engine, select, table, text
+from sqlalchemy.orm import Session
 
-#%%
-# Read Excel file
-df = pd.read_excel('/Users/alessiogandelli/dev/starthacktoursept25/moneybuddy-backend/data/transactions.xlsx', sheet_name='TRX Data')
+from models import db, Transaction, compress_payload
+import aggregates
+import migrations
 
-# Connect to SQLite database
-conn = sqlite3.connect('/Users/alessiogandelli/dev/starthacktoursept25/moneybuddy-backend/instance/transactions.db')
+DEFAULT_SHEET = 'TRX Data'
+DEFAULT_CHUNK_SIZE = 5000
 
 # Map Excel columns to database columns
-column_mapping = {
+COLUMN_MAPPING = {
     'TRX_ID': 'trx_id',
     'MONEY_ACCOUNT_NAME': 'account_name',
     'KUNDEN_NAME': 'customer_name',
@@ -32,64 +50,225 @@ column_mapping = {
     'CRED_REF_NR': 'reference_nr'
 }
 
-# Rename columns based on mapping
-df_mapped = df.rename(columns=column_mapping)
+# Columns written to the database
+FINAL_COLUMNS = [
+    'trx_id', 'account_iban', 'account_name', 'account_currency', 'customer_name',
+    'product', 'trx_type', 'booking_type', 'value_date', 'booking_date',
+    'direction', 'amount', 'currency', 'merchant_name', 'merchant_full_text',
+    'merchant_address', 'merchant_iban', 'card_id_masked', 'acquirer_country',
+    'reference_nr', 'raw_payload'
+]
+
+# Columns of the transactions table itself; raw_payload goes compressed to transaction_payloads
+TABLE_COLUMNS = [c for c in FINAL_COLUMNS if c != 'raw_payload']
+# Columns that identify a row's content for change detection
+HASHED_COLUMNS = TABLE_COLUMNS
+DATE_COLUMNS = ['value_date', 'booking_date']
 
-# Add missing columns with default values
-df_mapped['account_iban'] = df_mapped['account_name'].str.extract(r'([A-Z]{2}\d{2}[A-Z\d]+)')  # Extract IBAN if present
-df_mapped['account_currency'] = 'CHF'  # Default currency
-df_mapped['direction'] = df_mapped['trx_type'].apply(lambda x: 'debit' if 'debit' in str(x).lower() else 'credit')
+STAGING_TABLE = 'import_staging'
+STAGED = table(STAGING_TABLE, column('trx_id'), column('content_hash'), column('action'))
+BY_TRX_ID = and_(STAGED.c.trx_id != '', Transaction.trx_id != '', Transaction.trx_id == STAGED.c.trx_id)
+BY_CONTENT_HASH = and_(STAGED.c.trx_id == '', Transaction.trx_id == '',
+                       Transaction.content_hash == STAGED.c.content_hash)
+# what the spending aggregates are computed from
+AGGREGATED_COLUMNS = [Transaction.direction, Transaction.amount, Transaction.booking_date,
+                      Transaction.category, Transaction.merchant_name]
 
-# Find amount column - look for numeric columns or common amount column names
-amount_cols = [col for col in df.columns if any(x in col.upper() for x in ['AMOUNT', 'BETRAG', 'SUM', 'TOTAL'])]
-if amount_cols:
-    df_mapped['amount'] = pd.to_numeric(df[amount_cols[0]], errors='coerce').fillna(0)
-else:
-    # Try the last numeric column
+
+def iter_sheet_chunks(path: str, sheet: str = DEFAULT_SHEET, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Stream a worksheet as DataFrames of at most chunk_size rows"""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(h) if h is not None else f'Unnamed: {i}' for i, h in enumerate(header)]
+
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(row[:len(columns)])
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+def find_amount_column(df: pd.DataFrame) -> Optional[str]:
+    """Look for a column named like an amount, else fall back to the last numeric column"""
+    amount_cols = [col for col in df.columns if any(x in col.upper() for x in ['AMOUNT', 'BETRAG', 'SUM', 'TOTAL'])]
+    if amount_cols:
+        return amount_cols[0]
     numeric_cols = df.select_dtypes(include=['number']).columns
-    if len(numeric_cols) > 0:
-        df_mapped['amount'] = pd.to_numeric(df[numeric_cols[-1]], errors='coerce').fillna(0)
+    return numeric_cols[-1] if len(numeric_cols) > 0 else None
+
+
+def raw_payloads(df: pd.DataFrame) -> List[str]:
+    """Serialize every source row to JSON in one vectorized call"""
+    # JSON strings never contain a raw newline, so splitting on it is safe
+    return df.to_json(orient='records', lines=True, date_format='iso', default_handler=str).rstrip('\n').split('\n')
+
+
+def map_chunk(df: pd.DataFrame, amount_col: Optional[str], current_time: datetime) -> pd.DataFrame:
+    """Map one chunk of Excel rows to transaction columns, column-wise"""
+    df_mapped = df.rename(columns=COLUMN_MAPPING)
+    for column in set(COLUMN_MAPPING.values()) - set(df_mapped.columns):
+        df_mapped[column] = None
+
+    # Add missing columns with default values
+    df_mapped['account_iban'] = df_mapped['account_name'].astype('string').str.extract(r'([A-Z]{2}\d{2}[A-Z\d]+)', expand=False)
+    df_mapped['account_currency'] = 'CHF'
+    is_debit = df_mapped['trx_type'].astype(str).str.lower().str.contains('debit', regex=False)
+    df_mapped['direction'] = np.where(is_debit, 'debit', 'credit')
+
+    if amount_col:
+        df_mapped['amount'] = pd.to_numeric(df[amount_col], errors='coerce').fillna(0)
     else:
-        df_mapped['amount'] = 0  # Default fallback
+        df_mapped['amount'] = 0
 
-# Ensure currency is not null
-df_mapped['currency'] = df_mapped['currency'].fillna('CHF')
+    df_mapped['currency'] = df_mapped['currency'].fillna('CHF')
+    df_mapped['trx_id'] = df_mapped['trx_id'].fillna('').astype(str)
+    df_mapped['raw_payload'] = [compress_payload(payload) for payload in raw_payloads(df)]
 
-# Ensure direction is not null
-df_mapped['direction'] = df_mapped['direction'].fillna('credit')
+    df_final = df_mapped[FINAL_COLUMNS].copy()
+    df_final['value_date'] = pd.to_datetime(df_final['value_date'], errors='coerce')
+    df_final['booking_date'] = pd.to_datetime(df_final['booking_date'], errors='coerce')
 
-# Ensure trx_id is not null
-df_mapped['trx_id'] = df_mapped['trx_id'].fillna('').astype(str)
+    # Add timestamps for database tracking
+    df_final['created_at'] = current_time
+    df_final['updated_at'] = current_time
+    df_final['content_hash'] = content_hashes(df_final)
+    return df_final
 
-df_mapped['raw_payload'] = df.apply(lambda row: json.dumps(row.to_dict(), default=str), axis=1)
 
-# Select only the columns we need for the database
-final_columns = [
-    'trx_id', 'account_iban', 'account_name', 'account_currency', 'customer_name', 
-    'product', 'trx_type', 'booking_type', 'value_date', 'booking_date', 
-    'direction', 'amount', 'currency', 'merchant_name', 'merchant_full_text',
-    'merchant_address', 'merchant_iban', 'card_id_masked', 'acquirer_country',
-    'reference_nr', 'raw_payload'
-]
+def content_hashes(df: pd.DataFrame) -> pd.Series:
+    """64-bit hash of each row's mapped columns, as 16 hex digits"""
+    values = pd.DataFrame({
+        column: df[column].dt.strftime('%Y-%m-%d %H:%M:%S') if column in DATE_COLUMNS else df[column].astype('string')
+        for column in HASHED_COLUMNS
+    }).fillna('')
+    return pd.util.hash_pandas_object(values, index=False).map('{:016x}'.format)
 
-# Create final dataframe with only existing columns
-df_final = df_mapped[final_columns].copy()
 
-# Convert dates
-df_final['value_date'] = pd.to_datetime(df_final['value_date'], errors='coerce')
-df_final['booking_date'] = pd.to_datetime(df_final['booking_date'], errors='coerce')
+def upsert_chunk(conn, df_final: pd.DataFrame) -> Dict[str, int]:
+    """
+    Write one mapped chunk through a staging table.
+
+    Rows whose trx_id is already stored are updated only when their content
+    hash differs; rows without a trx_id are inserted unless an identical row
+    exists. Everything else is skipped. Inserted and updated rows get their
+    compressed raw payload written to transaction_payloads, and the spending
+    aggregates are adjusted by the old and new values of just those rows.
+    """
+    with_id = df_final['trx_id'] != ''
+    staged = pd.concat([
+        df_final[with_id].drop_duplicates('trx_id', keep='last'),
+        df_final[~with_id].drop_duplicates('content_hash')
+    ])
+    staged['action'] = None
+    staged.to_sql(STAGING_TABLE, conn, if_exists='replace', index=False)
+
+    # decide every staged row's fate once, before anything is written
+    conn.execute(text(f"""
+        UPDATE {STAGING_TABLE} SET action = 'insert'
+        WHERE CASE WHEN trx_id != ''
+            THEN NOT EXISTS (SELECT 1 FROM transactions t WHERE t.trx_id != '' AND t.trx_id = {STAGING_TABLE}.trx_id)
+            ELSE NOT EXISTS (SELECT 1 FROM transactions t WHERE t.content_hash = {STAGING_TABLE}.content_hash)
+        END
+    """))
+    updated = conn.execute(text(f"""
+        UPDATE {STAGING_TABLE} SET action = 'update'
+        WHERE trx_id != '' AND EXISTS (
+            SELECT 1 FROM transactions t WHERE t.trx_id != '' AND t.trx_id = {STAGING_TABLE}.trx_id
+              AND t.content_hash IS NOT {STAGING_TABLE}.content_hash
+        )
+    """)).rowcount
+
+    # the values updated rows had before this import
+    removed = conn.execute(
+        select(*AGGREGATED_COLUMNS).join(STAGED, BY_TRX_ID).where(STAGED.c.action == 'update')
+    ).all()
+
+    updated_columns = [c for c in TABLE_COLUMNS if c != 'trx_id'] + ['content_hash', 'updated_at']
+    conn.execute(text(f"""
+        UPDATE transactions SET {', '.join(f'{c} = s.{c}' for c in updated_columns)}
+        FROM {STAGING_TABLE} s
+        WHERE s.action = 'update' AND transactions.trx_id != '' AND transactions.trx_id = s.trx_id
+    """))
+
+    inserted_columns = ', '.join(TABLE_COLUMNS + ['content_hash', 'created_at', 'updated_at'])
+    inserted = conn.execute(text(f"""
+        INSERT INTO transactions ({inserted_columns})
+        SELECT {inserted_columns} FROM {STAGING_TABLE} s WHERE s.action = 'insert'
+    """)).rowcount
+
+    added = []
+    for match in (BY_TRX_ID, BY_CONTENT_HASH):
+        added += conn.execute(
+            select(*AGGREGATED_COLUMNS).join(STAGED, match).where(STAGED.c.action.isnot(None))
+        ).all()
+    aggregates.apply_changes(conn, removed, added)
+
+    # rows written above: match them by trx_id, or by hash without one
+    for match in ("s.trx_id != '' AND t.trx_id != '' AND t.trx_id = s.trx_id",
+                  "s.trx_id = '' AND t.trx_id = '' AND t.content_hash = s.content_hash"):
+        conn.execute(text(f"""
+            INSERT OR REPLACE INTO transaction_payloads (transaction_id, data)
+            SELECT t.id, s.raw_payload FROM {STAGING_TABLE} s JOIN transactions t ON {match}
+            WHERE s.action IS NOT NULL AND s.raw_payload IS NOT NULL
+        """))
+
+    conn.execute(text(f"DROP TABLE {STAGING_TABLE}"))
+    return {'inserted': inserted, 'updated': updated, 'skipped': len(df_final) - inserted - updated}
+
+
+def import_workbook(path: str, db_path: str, sheet: str = DEFAULT_SHEET, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    progress: Callable[[str], None] = print) -> Dict[str, int]:
+    """Import a workbook one committed chunk at a time. Returns inserted/updated/skipped counts."""
+    engine = create_engine(f"sqlite:///{db_path}")
+    db.metadata.create_all(engine)
+    migrations.upgrade(engine)
+
+    # a database from before the aggregates gets them built once; imports then keep them current
+    with Session(engine) as session:
+        aggregates.ensure_built(session)
+
+    current_time = datetime.now()
+    amount_col = None
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    processed = 0
+    started = time.perf_counter()
+    for i, chunk in enumerate(iter_sheet_chunks(path, sheet, chunk_size)):
+        if i == 0:
+            amount_col = find_amount_column(chunk)
+        df_final = map_chunk(chunk, amount_col, current_time)
+        with engine.begin() as conn:
+            for key, value in upsert_chunk(conn, df_final).items():
+                counts[key] += value
+        processed += len(df_final)
+        elapsed = time.perf_counter() - started
+        progress(f"Processed {processed} rows ({processed / elapsed:.0f} rows/s): "
+                 f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['skipped']} skipped")
+
+    return counts
 
-# Add timestamps for database tracking
-from datetime import datetime
-current_time = datetime.now()
-df_final['created_at'] = current_time
-df_final['updated_at'] = current_time
 
-# Insert into database
-df_final.to_sql('transactions', conn, if_exists='append', index=False)
+def main():
+    parser = argparse.ArgumentParser(description="Import an Excel transaction export into the transactions database")
+    parser.add_argument('xlsx_path', help="Path to the Excel export")
+    parser.add_argument('db_path', help="Path to the SQLite database file")
+    parser.add_argument('--sheet', default=DEFAULT_SHEET, help=f"Worksheet name (default: {DEFAULT_SHEET})")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows converted and inserted per batch")
+    args = parser.parse_args()
 
-print(f"Imported {len(df_final)} transactions to database")
-conn.close()
-# %%
+    counts = import_workbook(args.xlsx_path, args.db_path, args.sheet, args.chunk_size)
+    print(f"Import finished: {counts['inserted']} inserted, {counts['updated']} updated, {counts['skipped']} skipped")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Mapping of API payloads to transaction rows and bulk insertion"""
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Transaction, TransactionPayload, compress_payload
+import aggregates
+import storage
+
+# Rows written per INSERT ... executemany and per commit
+CHUNK_SIZE = 500
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value: str) -> Optional[datetime]:
+    """Parse an ISO timestamp from the API; feeds repeat dates a lot, so results are memoized"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+
+
+def map_payload(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a camelCase API payload to Transaction column values"""
+    if not isinstance(data, dict):
+        raise ValueError('Transaction must be a JSON object')
+    try:
+        amount = float(data.get('amount', 0))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid amount: {data.get('amount')!r}")
+
+    return {
+        'trx_id': data.get('trxId', ''),
+        'user_id': data.get('userId'),
+        'account_iban': data.get('accountIban'),
+        'account_name': data.get('accountName'),
+        'account_currency': data.get('accountCurrency'),
+        'customer_name': data.get('customerName'),
+        'product': data.get('product'),
+        'trx_type': data.get('trxType'),
+        'booking_type': data.get('bookingType'),
+        'value_date': parse_date(data['valueDate']) if data.get('valueDate') else None,
+        'booking_date': parse_date(data['bookingDate']) if data.get('bookingDate') else None,
+        'direction': data.get('direction', 'OUT'),
+        'amount': amount,
+        'currency': data.get('currency', 'EUR'),
+        'merchant_name': data.get('merchantName'),
+        'merchant_full_text': data.get('merchantFullText'),
+        'merchant_phone': data.get('merchantPhone'),
+        'merchant_address': data.get('merchantAddress'),
+        'merchant_iban': data.get('merchantIban'),
+        'card_id_masked': data.get('cardIdMasked'),
+        'acquirer_country': data.get('acquirerCountry'),
+        'reference_nr': data.get('referenceNr'),
+        'raw_payload': json.dumps(data.get('rawPayload')) if data.get('rawPayload') else None
+    }
+
+
+def parse_ndjson(text: str) -> List[Any]:
+    """Split an NDJSON body; undecodable lines are kept as errors for per-item reporting"""
+    items = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            items.append(ValueError(f'Invalid JSON: {e.msg}'))
+    return items
+
+
+def insert_rows(conn, rows: List[Dict[str, Any]]) -> None:
+    """INSERT mapped rows; their raw payloads go compressed into the side table"""
+    columns = [{k: v for k, v in row.items() if k != 'raw_payload'} for row in rows]
+    payloads = [row.get('raw_payload') for row in rows]
+    if not any(payloads):
+        conn.execute(insert(Transaction), columns)
+        return
+    ids = conn.scalars(insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True), columns).all()
+    conn.execute(insert(TransactionPayload), [
+        {'transaction_id': id_, 'data': compress_payload(payload)} for id_, payload in zip(ids, payloads) if payload
+    ])
+
+
+def bulk_insert(session, items: List[Any], chunk_size: int = CHUNK_SIZE) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Validate and insert many transactions, one transaction per chunk.
+
+    Each chunk goes in as a single executemany INSERT. If the chunk is rejected
+    it is replayed row by row in savepoints, so only the offending rows fail.
+    Returns the number of inserted rows and the failures as {index, error}.
+    """
+    inserted = 0
+    failures = []
+    for start in range(0, len(items), chunk_size):
+        rows = []
+        for index, item in enumerate(items[start:start + chunk_size], start):
+            try:
+                if isinstance(item, Exception):
+                    raise item
+                rows.append((index, map_payload(item)))
+            except ValueError as e:
+                failures.append({'index': index, 'error': str(e)})
+        if not rows:
+            continue
+
+        try:
+            insert_rows(session, [row for _, row in rows])
+            aggregates.apply_insert(session, [row for _, row in rows])
+            session.commit()
+            inserted += len(rows)
+            continue
+        except SQLAlchemyError:
+            session.rollback()
+
+        accepted = []
+        # savepoints must sit inside one transaction, or each RELEASE would commit its row
+        storage.begin(session)
+        for index, row in rows:
+            try:
+                with session.begin_nested():
+                    insert_rows(session, [row])
+                accepted.append(row)
+            except SQLAlchemyError as e:
+                failures.append({'index': index, 'error': str(e.orig if hasattr(e, 'orig') else e)})
+        aggregates.apply_insert(session, accepted)
+        session.commit()
+        inserted += len(accepted)
+
+    failures.sort(key=lambda f: f['index'])
+    return inserted, failures
@@ -0,0 +1,85 @@
+"""Disk-backed prompt -> response cache for LLM calls"""
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class PromptCache:
+    """
+    SQLite-backed cache keyed on (model, sha256(prompt)).
+
+    Entries expire after ttl seconds; once more than max_entries are stored the
+    least recently used ones are evicted. Safe to share between threads.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS prompt_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_prompt_cache_last_access ON prompt_cache (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def get(self, model: str, prompt: str) -> Optional[str]:
+        key = self.key(model, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM prompt_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE prompt_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model: str, prompt: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prompt_cache (key, model, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (self.key(model, prompt), model, response, now, now)
+            )
+            self._conn.execute("""
+                DELETE FROM prompt_cache WHERE key IN (
+                    SELECT key FROM prompt_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def discard(self, model: str, prompt: str) -> None:
+        """Forget a response that turned out to be unusable, so the next call asks again"""
+        with self._lock:
+            self._conn.execute("DELETE FROM prompt_cache WHERE key = ?", (self.key(model, prompt),))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries
+        }
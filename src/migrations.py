@@ -0,0 +1,193 @@
+"""
+Schema upgrades for existing transactions.db files
+
+db.create_all() only creates missing tables, so columns and indexes
+declared on the models never reach databases created before they were
+added. upgrade() brings an existing file in line with the models and is
+safe to re-run.
+
+Usage:
+    python migrations.py instance/transactions.db [--dedupe] [--explain]
+"""
+import argparse
+import logging
+from typing import Dict, List
+
+from sqlalchemy import create_engine, inspect, text
+
+from models import Transaction, TransactionPayload, compress_payload
+import aggregates
+import versioning
+
+logger = logging.getLogger(__name__)
+
+# The app's own hot queries, checked by explain()
+APP_QUERIES = {
+    'list page': (
+        "SELECT * FROM transactions WHERE booking_date IS NOT NULL "
+        "AND (booking_date, id) < (:booking_date, :id) ORDER BY booking_date DESC, id DESC LIMIT 101",
+        {'booking_date': '2025-01-01 00:00:00.000000', 'id': 1000}
+    ),
+    'list by direction': (
+        "SELECT * FROM transactions WHERE direction = :direction AND booking_date IS NOT NULL "
+        "ORDER BY booking_date DESC, id DESC LIMIT 101",
+        {'direction': 'OUT'}
+    ),
+    'chatbot recent': (
+        "SELECT * FROM transactions ORDER BY booking_date DESC LIMIT 5", {}
+    ),
+    'chatbot spending': (
+        "SELECT COUNT(*), SUM(amount), MAX(amount) FROM transactions WHERE direction = :direction",
+        {'direction': 'OUT'}
+    ),
+    'merchant lookup': (
+        "SELECT * FROM transactions WHERE merchant_name = :merchant", {'merchant': 'Migros'}
+    ),
+    'distinct merchants': (
+        "SELECT DISTINCT merchant_name FROM transactions WHERE merchant_name IS NOT NULL", {}
+    ),
+    'customer lookup': (
+        "SELECT * FROM transactions WHERE customer_name = :customer", {'customer': 'mario'}
+    ),
+    'trx_id lookup': (
+        "SELECT id FROM transactions WHERE trx_id = :trx_id AND trx_id != ''", {'trx_id': 'X1'}
+    ),
+}
+
+
+def duplicate_trx_ids(conn, limit: int = 10) -> List[str]:
+    rows = conn.execute(text(
+        "SELECT trx_id FROM transactions WHERE trx_id != '' "
+        "GROUP BY trx_id HAVING COUNT(*) > 1 LIMIT :limit"
+    ), {'limit': limit})
+    return [r[0] for r in rows]
+
+
+def remove_duplicate_trx_ids(conn) -> int:
+    """Keep the oldest row (lowest id) for every repeated trx_id, and the aggregates in line"""
+    result = conn.execute(text(
+        "DELETE FROM transactions WHERE trx_id != '' AND id NOT IN "
+        "(SELECT MIN(id) FROM transactions WHERE trx_id != '' GROUP BY trx_id)"
+    ))
+    conn.execute(text(
+        "DELETE FROM transaction_payloads WHERE transaction_id NOT IN (SELECT id FROM transactions)"
+    ))
+    if result.rowcount:
+        aggregates.rebuild(conn)
+    return result.rowcount
+
+
+def add_missing_columns(conn, table) -> List[str]:
+    """ALTER TABLE ADD COLUMN for model columns the database table lacks (all are nullable)"""
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+        added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def move_raw_payloads(conn, batch_size: int = 5000) -> int:
+    """
+    Compress the JSON of the old transactions.raw_payload column into
+    transaction_payloads, then drop the column. Returns the payloads moved.
+    """
+    columns = {c['name'] for c in inspect(conn).get_columns(Transaction.__tablename__)}
+    if 'raw_payload' not in columns:
+        return 0
+    rows = conn.execute(text(
+        "SELECT id, raw_payload FROM transactions WHERE raw_payload IS NOT NULL AND raw_payload != ''"
+    ))
+    moved = 0
+    while batch := rows.fetchmany(batch_size):
+        conn.execute(
+            text("INSERT OR IGNORE INTO transaction_payloads (transaction_id, data) VALUES (:id, :data)"),
+            [{'id': id_, 'data': compress_payload(payload)} for id_, payload in batch]
+        )
+        moved += len(batch)
+    conn.execute(text("ALTER TABLE transactions DROP COLUMN raw_payload"))
+    return moved
+
+
+def upgrade(engine, dedupe: bool = False) -> List[str]:
+    """
+    Add the columns and indexes declared on Transaction that the database is
+    missing, create the data version row and move raw payloads out of the
+    transactions table.
+
+    The unique trx_id index is skipped (with a warning) while duplicates exist,
+    unless dedupe=True, in which case the later copies are deleted first.
+    Returns the names of the columns and indexes created.
+    """
+    table = Transaction.__table__
+    if not inspect(engine).has_table(table.name):
+        return []
+
+    existing = {ix['name'] for ix in inspect(engine).get_indexes(table.name)}
+    created = []
+    with engine.begin() as conn:
+        created += add_missing_columns(conn, table)
+        TransactionPayload.__table__.create(conn, checkfirst=True)
+        moved = move_raw_payloads(conn)
+        if moved:
+            logger.info("Moved %d raw payloads to transaction_payloads", moved)
+            created.append('transaction_payloads')
+        versioning.transactions.install(conn)
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name in existing:
+                continue
+            if index.unique and duplicate_trx_ids(conn):
+                if not dedupe:
+                    logger.warning(
+                        "Skipping %s: duplicate trx_ids exist (e.g. %s). Re-run with dedupe to remove them.",
+                        index.name, ', '.join(duplicate_trx_ids(conn, 3))
+                    )
+                    continue
+                logger.info("Removed %d duplicate transactions", remove_duplicate_trx_ids(conn))
+            index.create(conn)
+            created.append(index.name)
+        if created:
+            # refresh planner statistics for the new indexes
+            conn.execute(text("ANALYZE transactions"))
+    if moved:
+        # repack the now much narrower rows into fewer pages
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text("VACUUM"))
+    return created
+
+
+def explain(engine) -> Dict[str, List[str]]:
+    """EXPLAIN QUERY PLAN for each of the app's queries"""
+    plans = {}
+    with engine.connect() as conn:
+        for name, (sql, params) in APP_QUERIES.items():
+            rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)
+            plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade a transactions database to the current schema")
+    parser.add_argument('db_path', help="Path to the SQLite database file")
+    parser.add_argument('--dedupe', action='store_true', help="Delete duplicate trx_ids so the unique index can be built")
+    parser.add_argument('--explain', action='store_true', help="Print EXPLAIN QUERY PLAN for the app's queries")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    engine = create_engine(f"sqlite:///{args.db_path}")
+
+    created = upgrade(engine, dedupe=args.dedupe)
+    print(f"Created: {', '.join(created) if created else 'nothing, schema is up to date'}")
+
+    if args.explain:
+        for name, plan in explain(engine).items():
+            print(f"\n{name}:")
+            for step in plan:
+                print(f"  {step}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,73 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from typing import Optional
 import json
+import zlib
 
 db = SQLAlchemy()
 
+# API field name -> column name, in the order to_dict() emits them
+API_FIELDS = {
+    'id': 'id',
+    'trxId': 'trx_id',
+    'userId': 'user_id',
+    'accountIban': 'account_iban',
+    'accountName': 'account_name',
+    'accountCurrency': 'account_currency',
+    'customerName': 'customer_name',
+    'product': 'product',
+    'trxType': 'trx_type',
+    'bookingType': 'booking_type',
+    'valueDate': 'value_date',
+    'bookingDate': 'booking_date',
+    'direction': 'direction',
+    'amount': 'amount',
+    'currency': 'currency',
+    'merchantName': 'merchant_name',
+    'merchantFullText': 'merchant_full_text',
+    'merchantPhone': 'merchant_phone',
+    'merchantAddress': 'merchant_address',
+    'merchantIban': 'merchant_iban',
+    'cardIdMasked': 'card_id_masked',
+    'acquirerCountry': 'acquirer_country',
+    'referenceNr': 'reference_nr',
+    'rawPayload': 'raw_payload',
+    'createdAt': 'created_at',
+    'updatedAt': 'updated_at'
+}
+
+# Fields returned unless the client asks for more: rawPayload is read from its side table only on request
+DEFAULT_FIELDS = [field for field in API_FIELDS if field != 'rawPayload']
+
+
+def compress_payload(text: Optional[str]) -> Optional[bytes]:
+    return zlib.compress(text.encode('utf-8')) if text else None
+
+
+def decompress_payload(data: Optional[bytes]) -> Optional[str]:
+    return zlib.decompress(data).decode('utf-8') if data else None
+
+
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # listings and chatbot: ORDER BY booking_date DESC, id DESC / WHERE direction = ? ORDER BY booking_date
+        db.Index('ix_transactions_booking_date_id', 'booking_date', 'id'),
+        db.Index('ix_transactions_direction_booking_date', 'direction', 'booking_date'),
+        # merchant / customer lookups
+        db.Index('ix_transactions_merchant_name', 'merchant_name'),
+        db.Index('ix_transactions_customer_name', 'customer_name'),
+        db.Index('ix_transactions_user_id', 'user_id'),
+        db.Index('ix_transactions_account_iban', 'account_iban'),
+        db.Index('ix_transactions_category', 'category'),
+        # a bank trx_id identifies one transaction; rows posted without one are exempt
+        db.Index('ix_transactions_content_hash', 'content_hash'),
+        db.Index('uq_transactions_trx_id', 'trx_id', unique=True, sqlite_where=db.text("trx_id != ''")),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     trx_id = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.String(64))  # owner; per-user databases hold only that user's rows
     
     # Account info
     account_iban = db.Column(db.String(50))
@@ -47,14 +106,28 @@ class Transaction(db.Model):
     reference_nr = db.Column(db.String(100))
     
     # Metadata
-    raw_payload = db.Column(db.Text)  # Store as JSON string
+    content_hash = db.Column(db.String(16))  # hash of the imported columns, lets re-imports skip unchanged rows
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def to_dict(self):
-        return {
+    # source record, compressed in its own table so scans of transactions stay narrow
+    payload = db.relationship('TransactionPayload', uselist=False, cascade='all, delete-orphan')
+    
+    @property
+    def raw_payload(self) -> Optional[str]:
+        """The source record as JSON text; loads the payload row on first access"""
+        return decompress_payload(self.payload.data) if self.payload else None
+    
+    @raw_payload.setter
+    def raw_payload(self, value: Optional[str]):
+        self.payload = TransactionPayload(data=compress_payload(value)) if value else None
+    
+    def to_dict(self, include_payload: bool = False):
+        """API representation; rawPayload only with include_payload, since it costs a query and a decompression"""
+        result = {
             'id': self.id,
             'trxId': self.trx_id,
+            'userId': self.user_id,
             'accountIban': self.account_iban,
             'accountName': self.account_name,
             'accountCurrency': self.account_currency,
@@ -75,7 +148,67 @@ class Transaction(db.Model):
             'cardIdMasked': self.card_id_masked,
             'acquirerCountry': self.acquirer_country,
             'referenceNr': self.reference_nr,
-            'rawPayload': json.loads(self.raw_payload) if self.raw_payload else None,
             'createdAt': self.created_at.isoformat() if self.created_at else None,
             'updatedAt': self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
+        }
+        if include_payload:
+            raw_payload = self.raw_payload
+            result['rawPayload'] = json.loads(raw_payload) if raw_payload else None
+        return result
+
+
+class TransactionPayload(db.Model):
+    """The source record a transaction was created from, as zlib-compressed JSON"""
+    __tablename__ = 'transaction_payloads'
+    
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id', ondelete='CASCADE'), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+class MerchantCategory(db.Model):
+    """Category assigned to each merchant; applied to transactions by monyca's categorization"""
+    __tablename__ = 'merchant_categories'
+    
+    merchant_name = db.Column(db.Text, primary_key=True)
+    category = db.Column(db.Text, nullable=False)
+
+
+class CategoryRule(db.Model):
+    """User-editable rule: merchants whose name or text contains pattern get category"""
+    __tablename__ = 'category_rules'
+    
+    pattern = db.Column(db.Text, primary_key=True)
+    category = db.Column(db.Text, nullable=False)
+
+
+class TableVersion(db.Model):
+    """Write counter of a table, bumped once per write transaction (see versioning.py)"""
+    __tablename__ = 'table_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    epoch = db.Column(db.String(16), nullable=False)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime)
+
+
+class SpendingAggregate(db.Model):
+    """Running count/sum/max of transaction amounts, kept up to date by the write paths"""
+    __tablename__ = 'spending_aggregates'
+    
+    dimension = db.Column(db.String(20), primary_key=True)  # total, month, category or merchant
+    key = db.Column(db.String(100), primary_key=True)  # '' for the total and for missing values
+    direction = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0)
+    max_amount = db.Column(db.Float)
+    
+    def to_dict(self):
+        return {
+            'dimension': self.dimension,
+            'key': self.key,
+            'direction': self.direction,
+            'count': self.count,
+            'total': self.total,
+            'average': self.total / self.count if self.count else None,
+            'max': self.max_amount
+        }
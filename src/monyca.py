@@ -1,11 +1,22 @@
 import sqlite3
 import json
 import os
-from typing import Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 from openai import OpenAI
 import pandas as pd
 
+from llm_cache import PromptCache
+import aggregates
+from categorizer import LocalCategorizer
+from readonly_db import QueryTimeout, ReadOnlyPool
+from result_cache import ResultCache
+from sql_templates import TemplateCache
+from prompt_builder import DEFAULT_RESULT_BUDGET, estimate_tokens, schema_summary, summarize_result
+
 # Carica le variabili d'ambiente
 load_dotenv()
 
@@ -13,18 +24,92 @@ load_dotenv()
 HF_API_KEY = os.getenv("HF_API_KEY")
 DB_PATH = os.getenv("DB_PATH")
 
-def get_database_schema(db_path: str) -> str:
-    with open("/home/dema/Downloads/transactions_schema_summary.md", "r", encoding="utf-8") as f:
-        return f.readlines()
+# Endpoint e modello configurabili (i test possono puntare a un server stub locale)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://router.huggingface.co/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-oss-20b:novita")
+
+# Cartella dei file di cache (l'app usa la sua instance folder, vedi set_cache_dir)
+CACHE_DIR = "."
+_caches: Dict[str, Any] = {}
+_caches_lock = threading.Lock()
+
+_client = None
+_client_lock = threading.Lock()
+
+# Categorizzazione: merchant per richiesta, richieste in parallelo, richieste al secondo
+CATEGORIZATION_BATCH_SIZE = int(os.getenv("CATEGORIZATION_BATCH_SIZE", 20))
+CATEGORIZATION_CONCURRENCY = int(os.getenv("CATEGORIZATION_CONCURRENCY", 4))
+CATEGORIZATION_RATE_LIMIT = float(os.getenv("CATEGORIZATION_RATE_LIMIT", 2.0))
+# Confidenza minima perche' il categorizzatore locale eviti la chiamata all'LLM
+LOCAL_CATEGORIZER_THRESHOLD = float(os.getenv("LOCAL_CATEGORIZER_THRESHOLD", 0.8))
+
+# Limiti per le query generate dall'LLM: secondi, righe restituite, connessioni aperte
+SQL_QUERY_TIMEOUT = float(os.getenv("SQL_QUERY_TIMEOUT", 5.0))
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", 1000))
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", 4))
+_query_pools: Dict[str, ReadOnlyPool] = {}
+_query_pools_lock = threading.Lock()
+
+# Risultati delle query recenti, validi finche' il database non cambia
+query_result_cache = ResultCache(int(os.getenv("SQL_RESULT_CACHE_SIZE", 256)))
+
+
+# Budget (in token stimati) per i risultati delle query inclusi nel prompt
+PROMPT_RESULT_BUDGET = int(os.getenv("PROMPT_RESULT_BUDGET", DEFAULT_RESULT_BUDGET))
+
+def set_cache_dir(directory: str) -> None:
+    """Cartella in cui aprire i file di cache; da chiamare prima del primo uso"""
+    global CACHE_DIR
+    os.makedirs(directory, exist_ok=True)
+    CACHE_DIR = directory
+
+def _cache_path() -> str:
+    return os.getenv("LLM_CACHE_PATH") or os.path.join(CACHE_DIR, ".llm_cache.db")
+
+def get_prompt_cache() -> PromptCache:
+    """Cache su disco delle risposte: chiave (modello, hash del prompt), TTL + LRU"""
+    with _caches_lock:
+        if 'prompts' not in _caches:
+            _caches['prompts'] = PromptCache(
+                _cache_path(),
+                ttl=float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600)),
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+            )
+        return _caches['prompts']
+
+def get_sql_templates() -> TemplateCache:
+    """Template domanda -> SQL imparati dalle risposte andate a buon fine"""
+    with _caches_lock:
+        if 'templates' not in _caches:
+            _caches['templates'] = TemplateCache(os.getenv("SQL_TEMPLATE_PATH") or _cache_path())
+        return _caches['templates']
 
-def call_llm(prompt: str) -> str:
-    client = OpenAI(
-        base_url="https://router.huggingface.co/v1",
-        api_key=os.environ["HF_API_KEY"],
-    )
-
-    completion = client.chat.completions.create(
-        model="openai/gpt-oss-20b:novita",
+def get_database_schema(db_path: str) -> str:
+    """Riassunto compatto dello schema, generato dal database stesso"""
+    with get_query_pool(db_path).connection() as conn:
+        return schema_summary(conn)
+
+def get_client() -> OpenAI:
+    """Client condiviso dal modulo: la sua connection pool HTTP tiene vive le connessioni tra le chiamate"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    base_url=LLM_BASE_URL,
+                    api_key=os.environ["HF_API_KEY"],
+                )
+    return _client
+
+def call_llm(prompt: str, use_cache: bool = True) -> str:
+    print(f"Prompt size: {len(prompt)} chars, ~{estimate_tokens(prompt)} tokens")
+    if use_cache:
+        cached = get_prompt_cache().get(LLM_MODEL, prompt)
+        if cached is not None:
+            return cached
+
+    completion = get_client().chat.completions.create(
+        model=LLM_MODEL,
         messages=[
             {
                 "role": "user",
@@ -33,22 +118,56 @@ def call_llm(prompt: str) -> str:
         ],
     )
     response = dict(completion.choices[0].message)
+    if use_cache and response["content"]:
+        get_prompt_cache().put(LLM_MODEL, prompt, response["content"])
     return response["content"]
 
-def execute_database_query(sql_query: str) -> Dict[str, Any]:
+def stream_llm(prompt: str, use_cache: bool = True) -> Iterator[str]:
+    """Come call_llm, ma restituisce il testo a pezzi man mano che il modello lo genera"""
+    print(f"Prompt size: {len(prompt)} chars, ~{estimate_tokens(prompt)} tokens")
+    if use_cache:
+        cached = get_prompt_cache().get(LLM_MODEL, prompt)
+        if cached is not None:
+            yield cached
+            return
+
+    stream = get_client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+    )
+    parts = []
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+            yield delta
+    if use_cache and parts:
+        get_prompt_cache().put(LLM_MODEL, prompt, ''.join(parts))
+
+def get_query_pool(db_path: str) -> ReadOnlyPool:
+    """Pool di connessioni read-only per il database indicato, creato alla prima query"""
+    with _query_pools_lock:
+        if db_path not in _query_pools:
+            _query_pools[db_path] = ReadOnlyPool(db_path, SQL_POOL_SIZE, SQL_QUERY_TIMEOUT, SQL_MAX_ROWS)
+        return _query_pools[db_path]
+
+def execute_database_query(sql_query: str, use_cache: bool = True, db_path: Optional[str] = None) -> Dict[str, Any]:
     """
     Esegue una query SQL sul database delle transazioni
     
     Args:
         sql_query: Query SQL da eseguire
         is_final_answer: True se il risultato è la risposta finale, False se serve per ulteriore elaborazione
+        use_cache: riusa il risultato di una query equivalente se il database non è cambiato
+        db_path: database da interrogare (default: variabile d'ambiente DB_PATH)
     
     Returns:
         Risultati della query formattati
     """
     try:
-        # Get DB_PATH from environment
-        DB_PATH = os.getenv("DB_PATH")
+        # Get DB_PATH from the caller or the environment
+        DB_PATH = db_path or os.getenv("DB_PATH")
         
         # More detailed error checking
         if not DB_PATH:
@@ -74,44 +193,54 @@ def execute_database_query(sql_query: str) -> Dict[str, Any]:
         if not cleaned_query.startswith('SELECT'):
             return {"error": "Only SELECT queries are allowed"}
         
-        """Using pandas - returns DataFrame directly"""
-        try:
-            # This automatically handles connection, execution, and conversion to DataFrame
-            df = pd.read_sql_query(sql_query, sqlite3.connect(DB_PATH))
-                        
-        except sqlite3.Error as e:
-            return {"error": f"SQL execution error: {str(e)}", "dataframe": None}
-        except Exception as e:
-            return {"error": f"Unexpected error: {str(e)}", "dataframe": None}
-
-        conn = None
-        try:
-            conn = sqlite3.connect(DB_PATH)                
-            df = pd.read_sql_query(sql_query, conn)
-                        
-            return {
-                "success": True,
-                "dataframe": df,
-                "query_info": {
-                    "rows": len(df),
-                    "columns": list(df.columns),
-                    "dtypes": df.dtypes.to_dict()
-                }
-            }
-            
-        except Exception as e:
-            return {
-                "success": False,
-                "dataframe": None,
-                "error": str(e)
+        pool = get_query_pool(DB_PATH)
+        generation = pool.generation()
+        cached = query_result_cache.get(DB_PATH, sql_query, generation) if use_cache else None
+        if cached is not None:
+            columns, rows, truncated = cached
+        else:
+            try:
+                # Una sola esecuzione, su connessione read-only, con timeout e limite di righe
+                columns, rows, truncated = pool.query(sql_query)
+            except QueryTimeout as e:
+                return {"error": str(e), "dataframe": None}
+            except sqlite3.Error as e:
+                return {"error": f"SQL execution error: {str(e)}", "dataframe": None}
+            if use_cache:
+                query_result_cache.put(DB_PATH, sql_query, generation, (columns, rows, truncated))
+
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        return {
+            "success": True,
+            "dataframe": df,
+            "query_info": {
+                "rows": len(df),
+                "columns": list(df.columns),
+                "dtypes": df.dtypes.to_dict(),
+                "truncated": truncated,
+                "cached": cached is not None
             }
-        finally:
-            if conn:
-                conn.close()
+        }
         
     except Exception as e:
         return {"error": f"Unexpected error: {str(e)}"}
 
+class RateLimiter:
+    """Distanzia le chiamate di almeno 1/rate secondi, condiviso tra thread"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
 def parse_llm_response(response: str) -> tuple[Optional[str], Optional[bool], Optional[str]]:
     """
     Estrae informazioni dalla risposta dell'LLM
@@ -138,8 +267,10 @@ def parse_llm_response(response: str) -> tuple[Optional[str], Optional[bool], Op
         return None
 
 class FinanceManager:
-    def __init__(self):
-        self.schema = get_database_schema(DB_PATH) if DB_PATH else "Schema non disponibile"
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or DB_PATH
+        self.schema = get_database_schema(self.db_path) if self.db_path else "Schema non disponibile"
+        self._merchants_generation = None
         
     def get_system_prompt(self, user_query: str="", task: str="", db_result = None) -> str:
         """Genera il system prompt per l'LLM"""
@@ -176,7 +307,7 @@ You know the user and you have access to the following database, which contains
 Please respond to the following user request: {user_query}
 
 The following data, extracted from the user's database, are relevant to the request:
-{db_result["dataframe"]}
+{summarize_result(db_result["dataframe"], PROMPT_RESULT_BUDGET, db_result["query_info"]["truncated"])}
 
 Provide a detailed, helpful response:"""
         elif task == "categorization_definition":
@@ -210,97 +341,213 @@ Here are the categories:
 Provide as output a json list of couples with just the categories assigned to each merchant, in the same order as the merchant names provided. If a merchant name is ambiguous or does not clearly fit into a specific category, assign it to a general category "Other".
 
 Example output:
-{{"merchant_categories": [("marchant_name_x", "category_n"), ("merchant_name_y", "category_n2"), ("merchant_name_z", "category_n3"),..]}}"""
+{{"merchant_categories": [["merchant_name_x", "category_n"], ["merchant_name_y", "category_n2"], ["merchant_name_z", "category_n3"]]}}"""
+
+    def _categorize_batch(self, merchants: List[str], categories: List[str], limiter: RateLimiter) -> Dict[str, str]:
+        """Una richiesta all'LLM per un gruppo di merchant; restituisce solo le assegnazioni valide"""
+        limiter.wait()
+        system_prompt = self.get_system_prompt(user_query=merchants, task="categorization_assignment", db_result=categories)
+        data = parse_llm_response(call_llm(system_prompt)) or {}
+
+        assigned = {}
+        for pair in data.get("merchant_categories") or []:
+            if isinstance(pair, (list, tuple)) and len(pair) == 2 and pair[0] in merchants:
+                assigned[pair[0]] = pair[1] if pair[1] in categories else "Other"
+        if not assigned:
+            # risposta inutilizzabile: non tenerla in cache, il gruppo verra' ritentato
+            get_prompt_cache().discard(LLM_MODEL, system_prompt)
+        return assigned
+
+    def categorize_merchants(self, merchants: List[str], categories: List[str],
+                             on_batch: Callable[[Dict[str, str]], None],
+                             batch_size: int = CATEGORIZATION_BATCH_SIZE,
+                             concurrency: int = CATEGORIZATION_CONCURRENCY,
+                             rate_limit: float = CATEGORIZATION_RATE_LIMIT) -> int:
+        """
+        Categorizza i merchant in gruppi disgiunti, in parallelo e con un limite di richieste al secondo.
+
+        on_batch riceve il risultato di ogni gruppo appena completato (dal thread chiamante),
+        così può essere salvato subito. I gruppi falliti vengono saltati e ritentati al
+        prossimo avvio. Restituisce il numero di merchant categorizzati.
+        """
+        batches = [merchants[i:i + batch_size] for i in range(0, len(merchants), batch_size)]
+        limiter = RateLimiter(rate_limit)
+        done = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(self._categorize_batch, batch, categories, limiter) for batch in batches]
+            for i, future in enumerate(as_completed(futures), 1):
+                try:
+                    assigned = future.result()
+                except Exception as e:
+                    print(f"Batch failed, will be retried on the next run: {e}")
+                    continue
+                on_batch(assigned)
+                done += len(assigned)
+                print(f"Categorized batch {i}/{len(batches)} ({done}/{len(merchants)} merchants)")
+        return done
 
     def categorization(self):
-        """Add categories to transactions table"""
-        conn = sqlite3.connect(DB_PATH)
+        """
+        Categorize merchants that are not in merchant_categories yet, then apply the lookup table.
+
+        New merchants are first matched locally (category_rules and known merchants,
+        see categorizer.py); only the ones without a confident match cost an LLM
+        lookup. The transactions are updated with a single UPDATE ... FROM.
+        """
+        conn = sqlite3.connect(self.db_path)
         
-        # Check if category column exists
-        columns = pd.read_sql_query("PRAGMA table_info(transactions)", conn)['name'].tolist()
-        if 'category' in columns:
-            # just for testing
-            other_cols = ', '.join([col for col in columns if col != 'category'])
-            conn.executescript(f"CREATE TABLE temp_transactions AS SELECT {other_cols} FROM transactions; DROP TABLE transactions; ALTER TABLE temp_transactions RENAME TO transactions;")
-            conn.close()
-            return "Category column already exists"
+        # Add the category column only if the database predates it
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(transactions)")]
+        if 'category' not in columns:
+            conn.execute("ALTER TABLE transactions ADD COLUMN category VARCHAR(100)")
         
-        # Get unique merchants and categorize them
-        merchants = pd.read_sql_query("SELECT DISTINCT merchant_name FROM transactions WHERE merchant_name IS NOT NULL", conn)['merchant_name'].tolist()
-        unique_merchants = list(set(merchants))
-
-        system_prompt = self.get_system_prompt(user_query = unique_merchants, task= "categorization_definition")
-        print(f" First prompt: {system_prompt}")
-        response = call_llm(system_prompt)
-        print(f"LLM SQL response: {response}")
-        data = parse_llm_response(response)
-        if not data:
-            return "Failed to get categories from LLM"
-        categories = data.get("categories")
-        merchant_map = {"merchant_categories": []}
-        if not isinstance(categories, list):
-            print("No categories found")
-        else:
-            print("\n\n")
-            print(merchants)
-            input("Press Enter to continue...")
-            i = 0
-            for i in range(0, len(merchants), 10):
-                group = merchants[i:i+20]
-                # process group of 20 merchants
-                print(group)
-                system_prompt = self.get_system_prompt(user_query = group, task= "categorization_assignment", db_result = categories)
-                print(f" First prompt: {system_prompt}")
-                response = call_llm(system_prompt)
-                data = parse_llm_response(response)
-                if data:
-                    merchant_map["merchant_categories"].extend(data["merchant_categories"])
-                print("\n\n\n\n________________________________")
-                print(f"LLM so far: {merchant_map}")
-                print("\n\n\n")
+        # Progressi salvati: categorie scelte e merchant gia' categorizzati sopravvivono a un'interruzione
+        conn.execute("CREATE TABLE IF NOT EXISTS categories (name TEXT PRIMARY KEY)")
+        conn.execute("CREATE TABLE IF NOT EXISTS merchant_categories (merchant_name TEXT PRIMARY KEY, category TEXT NOT NULL)")
+        conn.commit()
+        
+        # Only merchants without a stored category are considered
+        full_text = "MAX(merchant_full_text)" if 'merchant_full_text' in columns else "NULL"
+        new_merchants = conn.execute(f"""
+            SELECT merchant_name, {full_text} FROM transactions t
+            WHERE merchant_name IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM merchant_categories mc WHERE mc.merchant_name = t.merchant_name)
+            GROUP BY merchant_name
+        """).fetchall()
+        categories = [row[0] for row in conn.execute("SELECT name FROM categories")]
+        
+        def save_batch(assigned: Dict[str, str]):
+            conn.executemany("INSERT OR REPLACE INTO merchant_categories (merchant_name, category) VALUES (?, ?)", assigned.items())
+            conn.commit()
+            for merchant, category in assigned.items():
+                local.add(merchant, category)
+        
+        # First pass: rules and already categorized merchants; only the rest goes to the LLM
+        local = LocalCategorizer.from_connection(conn, LOCAL_CATEGORIZER_THRESHOLD)
+        local_matches, pending = local.split(new_merchants)
+        save_batch(local_matches)
+        print(f"{len(new_merchants)} new merchants: {len(local_matches)} categorized locally, {len(pending)} for the LLM")
+        
+        if pending and not categories:
+            system_prompt = self.get_system_prompt(user_query = pending, task= "categorization_definition")
+            response = call_llm(system_prompt)
+            print(f"LLM categories response: {response}")
+            data = parse_llm_response(response)
+            if not data or not isinstance(data.get("categories"), list):
+                conn.close()
+                return "Failed to get categories from LLM"
+            categories = data["categories"]
+            if "Other" not in categories:
+                categories.append("Other")
+            conn.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", [(c,) for c in categories])
+            conn.commit()
+        
+        categorized = self.categorize_merchants(pending, categories, save_batch) if pending else 0
+        
+        # Set-based application: only rows whose category actually changes are written
+        updated = conn.execute("""
+            UPDATE transactions SET category = mc.category
+            FROM merchant_categories mc
+            WHERE transactions.merchant_name = mc.merchant_name AND transactions.category IS NOT mc.category
+        """).rowcount
+        updated += conn.execute(
+            "UPDATE transactions SET category = 'Unknown' WHERE merchant_name IS NULL AND category IS NOT 'Unknown'"
+        ).rowcount
         
-        # Add column and update rows
-        conn.execute("ALTER TABLE transactions ADD COLUMN category VARCHAR(50)")
-        for merchant, category in dict(merchant_map).items():
-            conn.execute("UPDATE transactions SET category = ? WHERE merchant_name = ?", (category, merchant))
-        conn.execute("UPDATE transactions SET category = 'Unknown' WHERE merchant_name IS NULL")
+        # the per-category spending aggregates depend on the column we just rewrote
+        if updated and conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'spending_aggregates'").fetchone():
+            for sql in aggregates.REBUILD_SQL:
+                conn.execute(sql)
         
         conn.commit()
         conn.close()
-        return f"Added categories for {len(merchants)} merchants"
+        return (f"Categorized {len(local_matches)} merchants locally and {categorized} of {len(pending)} with the LLM, "
+                f"updated {updated} transactions")
+
+    def refresh_template_merchants(self):
+        """Aggiorna i nomi dei merchant riconosciuti nelle domande quando il database cambia"""
+        pool = get_query_pool(self.db_path)
+        generation = pool.generation()
+        if generation != self._merchants_generation:
+            _, rows, _ = pool.query("SELECT DISTINCT merchant_name FROM transactions WHERE merchant_name IS NOT NULL",
+                                    max_rows=100000)
+            get_sql_templates().set_merchants(row[0] for row in rows)
+            self._merchants_generation = generation
+
+    def generate_sql(self, user_query: str):
+        """
+        Restituisce (sql_query, is_final, from_template, direct_response).
+
+        Una domanda con la stessa forma di una gia' risolta riusa il suo template
+        SQL senza chiamare l'LLM; le altre passano dall'LLM.
+        """
+        try:
+            self.refresh_template_merchants()
+            template = get_sql_templates().lookup(user_query)
+        except sqlite3.Error as e:
+            print(f"Template cache unavailable: {e}")
+            template = None
+        if template is not None:
+            print(f"SQL template hit: {template[0]}")
+            return template[0], template[1], True, None
 
-    def process_query(self, user_query: str) -> str:
-        
         # Chiedi all'LLM se serve estrarre dal database SQL
         system_prompt = self.get_system_prompt(user_query, task= "SQL_query")
-        print(f" First prompt: {system_prompt}")
         response = call_llm(system_prompt)
         print(f"LLM SQL response: {response}")
 
-        
-        # Parsing
+        # Parsing: senza JSON l'LLM ha risposto direttamente
         data = parse_llm_response(response)
-
-        sql_query = data.get("query")
-        is_final = data.get("stop", True)
+        if data is None:
+            return None, True, False, response
+        return data.get("query"), data.get("stop", True), False, None
+
+    def stream_query(self, user_query: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Esegue la pipeline domanda -> SQL -> risposta producendo eventi (tipo, dati):
+        "status" a ogni fase ("generating_sql", "querying_data", "answering") e
+        "token" con il testo della risposta, trasmesso mentre l'LLM lo genera.
+        """
+        yield "status", {"stage": "generating_sql"}
+        sql_query, is_final, from_template, direct_response = self.generate_sql(user_query)
+        if direct_response is not None:
+            yield "token", {"text": direct_response}
+            return
         
         if not sql_query:
-            return "Non sono riuscito a generare una query SQL appropriata."
+            yield "token", {"text": "Non sono riuscito a generare una query SQL appropriata."}
+            return
         
         # STEP 3: Esegui la query
-        db_result = execute_database_query(sql_query)
-        print(f"From database: {db_result['dataframe']}")
+        yield "status", {"stage": "querying_data", "sql": sql_query, "from_template": from_template}
+        db_result = execute_database_query(sql_query, db_path=self.db_path)
+        print(f"From database: {db_result.get('dataframe')}")
         
         if "error" in db_result:
-            return f"Errore nel database: {db_result['error']}"
+            if from_template:
+                # il template non vale per questa domanda: dimenticalo e chiedi all'LLM
+                get_sql_templates().forget(user_query)
+                yield from self.stream_query(user_query)
+                return
+            yield "token", {"text": f"Errore nel database: {db_result['error']}"}
+            return
+        
+        if not from_template:
+            get_sql_templates().learn(user_query, sql_query, is_final)
         
         # STEP 4: Se è risposta finale, formatta e restituisci
         if is_final and not db_result['success']:
-            return "Non ho trovato dati per la tua richiesta."
+            yield "token", {"text": "Non ho trovato dati per la tua richiesta."}
+            return
         
         # STEP 5: Se serve elaborazione, chiama di nuovo l'LLM con i dati
+        yield "status", {"stage": "answering", "rows": db_result["query_info"]["rows"]}
         context_prompt = self.get_system_prompt(user_query, "SQL_conclusion", db_result)
-        return call_llm(context_prompt)
+        for text in stream_llm(context_prompt):
+            yield "token", {"text": text}
+
+    def process_query(self, user_query: str) -> str:
+        return ''.join(data["text"] for event, data in self.stream_query(user_query) if event == "token")
 
 def main():
     """Funzione principale per testare il sistema"""
@@ -0,0 +1,81 @@
+"""
+Compact, size-bounded prompt sections for the finance assistant
+
+The schema summary is generated from PRAGMA table_info (plus the values of a
+few low-cardinality columns) instead of a hand-written markdown file, and
+query results are rendered as CSV within a token budget: small results are
+shown whole, large ones as column statistics plus as many rows as fit.
+"""
+import sqlite3
+from typing import Iterable, Optional
+
+import pandas as pd
+
+DEFAULT_RESULT_BUDGET = 1500
+SCHEMA_TABLES = ('transactions', 'merchant_categories', 'categories')
+# Columns whose distinct values help the model write correct WHERE clauses
+ENUM_COLUMNS = ('direction', 'currency', 'category', 'trx_type', 'booking_type')
+MAX_ENUM_VALUES = 12
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text and SQL)"""
+    return (len(text) + 3) // 4
+
+
+def schema_summary(conn: sqlite3.Connection, tables: Iterable[str] = SCHEMA_TABLES) -> str:
+    """One line per table with its columns and types, and the values of enum-like columns"""
+    lines = []
+    for table in tables:
+        columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        if not columns:
+            continue
+        lines.append(f"{table}({', '.join(f'{c[1]} {c[2]}'.strip() for c in columns)})")
+        for name in (c[1] for c in columns if c[1] in ENUM_COLUMNS):
+            values = [r[0] for r in conn.execute(
+                f"SELECT DISTINCT {name} FROM {table} WHERE {name} IS NOT NULL LIMIT {MAX_ENUM_VALUES + 1}"
+            )]
+            if values and len(values) <= MAX_ENUM_VALUES:
+                lines.append(f"  {table}.{name} values: {', '.join(map(str, values))}")
+    return '\n'.join(lines)
+
+
+def summarize_result(df: Optional[pd.DataFrame], budget: int = DEFAULT_RESULT_BUDGET, truncated: bool = False) -> str:
+    """
+    Render a query result within roughly `budget` tokens.
+
+    Results that fit are written as CSV. Larger ones get the row count,
+    per-column statistics (sum/mean/min/max for numbers, top values for
+    text) and the first rows that still fit, with a note saying so.
+    """
+    if df is None or df.empty:
+        return "(no rows)"
+    note = " The query hit the row limit, so more rows exist." if truncated else ""
+
+    full = df.to_csv(index=False, float_format='%.2f')
+    if estimate_tokens(full) <= budget:
+        return full + (f"\nNote:{note}" if note else "")
+
+    parts = [f"{len(df)} rows, columns: {', '.join(map(str, df.columns))}.{note}", "Column summary:"]
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_numeric_dtype(series):
+            parts.append(f"  {column}: sum={series.sum():.2f} mean={series.mean():.2f} "
+                         f"min={series.min():.2f} max={series.max():.2f}")
+        else:
+            top = series.value_counts().head(5)
+            parts.append(f"  {column}: {series.nunique()} distinct, top: "
+                         f"{', '.join(f'{v} ({n})' for v, n in top.items())}")
+    header = '\n'.join(parts)
+
+    # as many leading rows as the remaining budget allows
+    lines = full.splitlines()
+    remaining = budget - estimate_tokens(header) - 20
+    shown = [lines[0]]
+    for line in lines[1:]:
+        remaining -= estimate_tokens(line) + 1
+        if remaining < 0:
+            break
+        shown.append(line)
+    rows = len(shown) - 1
+    return f"{header}\nFirst {rows} of {len(df)} rows:\n" + '\n'.join(shown)
@@ -0,0 +1,153 @@
+"""Filtering and keyset pagination helpers for transaction listings"""
+import base64
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import String, select, tuple_, type_coerce
+
+from models import Transaction
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def parse_datetime(value: str) -> datetime:
+    """Parse an ISO date/datetime query parameter as naive UTC (a trailing Z or an offset is accepted)"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_end(value: str) -> datetime:
+    """Exclusive upper bound for an inclusive dateTo: a bare date covers the whole day"""
+    end = parse_datetime(value)
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return end + timedelta(microseconds=1)
+    return end + timedelta(days=1)
+
+
+def parse_amount(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Invalid amount: {value}")
+
+
+def parse_limit(value: Optional[str]) -> int:
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid limit: {value}")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+# booking_date as the text SQLite stores and orders by. Older imports wrote
+# 'YYYY-MM-DD HH:MM:SS', SQLAlchemy writes 'YYYY-MM-DD HH:MM:SS.ffffff'; a bound
+# datetime would only match the latter, so cursors carry and compare the raw text.
+BOOKING_DATE_TEXT = type_coerce(Transaction.booking_date, String)
+
+
+def date_text(value: datetime) -> str:
+    """
+    A bound to compare with BOOKING_DATE_TEXT. Without microseconds it is
+    written without a fraction, so it sorts right against both stored forms:
+    '...00:00:00' <= '...00:00:00' < '...00:00:00.000000' < '...00:00:00.500000'.
+    """
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f' if value.microsecond else '%Y-%m-%d %H:%M:%S')
+
+
+def encode_cursor(booking_date: Optional[str], transaction_id: int) -> str:
+    """Opaque token pointing just after the given (stored booking_date text, id) position"""
+    payload = json.dumps([booking_date or None, transaction_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> Tuple[Optional[str], int]:
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        booking_date, transaction_id = json.loads(base64.urlsafe_b64decode(padded))
+        if booking_date is not None and not isinstance(booking_date, str):
+            raise ValueError(booking_date)
+        return booking_date or None, int(transaction_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def apply_filters(query, args: Dict[str, Any]):
+    """Push the listing filters supported by GET /transaction into SQL"""
+    if args.get('dateFrom'):
+        query = query.filter(BOOKING_DATE_TEXT >= date_text(parse_datetime(args['dateFrom'])))
+    if args.get('dateTo'):
+        query = query.filter(BOOKING_DATE_TEXT < date_text(parse_end(args['dateTo'])))
+    if args.get('direction'):
+        query = query.filter(Transaction.direction == args['direction'])
+    if args.get('currency'):
+        query = query.filter(Transaction.currency == args['currency'])
+    if args.get('merchant'):
+        query = query.filter(Transaction.merchant_name == args['merchant'])
+    if args.get('customer'):
+        query = query.filter(Transaction.customer_name == args['customer'])
+    if args.get('minAmount'):
+        query = query.filter(Transaction.amount >= parse_amount(args['minAmount']))
+    if args.get('maxAmount'):
+        query = query.filter(Transaction.amount <= parse_amount(args['maxAmount']))
+    return query
+
+
+def _fetch(query, session) -> list:
+    return session.execute(query).all() if session is not None else query.all()
+
+
+def paginate(query, args: Dict[str, Any], session=None):
+    """
+    Return one page of the filtered listing and the cursor for the next page.
+
+    query is either an ORM query (rows are Transaction objects) or, with a
+    session, a select() of columns including booking_date and id (rows are
+    plain tuples).
+
+    Rows are ordered by (booking_date DESC, id DESC) and the cursor is compared
+    as a row value, so SQLite seeks straight to the position in the index and
+    page cost depends only on the page size, never on how deep the cursor is.
+    Undated rows sort last and are paged by id once the dated rows run out.
+    """
+    limit = parse_limit(args.get('limit'))
+    query = apply_filters(query, args)
+
+    booking_date, last_id = decode_cursor(args['cursor']) if args.get('cursor') else (None, None)
+    rows = []
+    if last_id is None or booking_date is not None:
+        dated = query.filter(Transaction.booking_date.isnot(None))
+        if booking_date is not None:
+            dated = dated.filter(tuple_(BOOKING_DATE_TEXT, Transaction.id) < tuple_(booking_date, last_id))
+        rows = _fetch(dated.order_by(Transaction.booking_date.desc(), Transaction.id.desc()).limit(limit + 1), session)
+
+    if len(rows) <= limit:
+        undated = query.filter(Transaction.booking_date.is_(None))
+        if booking_date is None and last_id is not None:
+            undated = undated.filter(Transaction.id < last_id)
+        rows += _fetch(undated.order_by(Transaction.id.desc()).limit(limit + 1 - len(rows)), session)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if last.booking_date is not None:
+            # the row's date as stored, not as selected (it may be reformatted or a datetime)
+            session = session if session is not None else query.session
+            stored = session.execute(select(BOOKING_DATE_TEXT).where(Transaction.id == last.id)).scalar()
+        else:
+            stored = None
+        next_cursor = encode_cursor(stored, last.id)
+    return rows, next_cursor
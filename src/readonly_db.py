@@ -0,0 +1,124 @@
+"""Pool of read-only SQLite connections for running untrusted (LLM-generated) queries"""
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Sequence, Tuple
+
+# How many SQLite VM instructions run between two deadline checks
+PROGRESS_INTERVAL = 10000
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class ReadOnlyPool:
+    """
+    Up to `size` connections opened with mode=ro and query_only, reused across queries.
+
+    query() enforces a wall-clock timeout through a progress handler, which
+    interrupts the statement inside SQLite, and fetches at most max_rows rows
+    in fetchmany() batches instead of materializing the full result.
+    """
+
+    def __init__(self, path: str, size: int = 4, timeout: float = 5.0, max_rows: int = 1000):
+        self.path = path
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+        self._slots = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._slots.put(None)
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+        self._data_version = None
+        self._generation = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection, waiting while all `size` are in use"""
+        self._slots.get()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except Exception:
+                # don't hand a connection in an unknown state to the next caller
+                conn.close()
+                raise
+            else:
+                self._idle.put_nowait(conn)
+        finally:
+            self._slots.put(None)
+
+    def query(self, sql: str, params: Sequence[Any] = (), timeout: float = None,
+              max_rows: int = None) -> Tuple[List[str], List[tuple], bool]:
+        """
+        Run one statement. Returns (columns, rows, truncated).
+
+        Raises QueryTimeout when it runs longer than timeout seconds and
+        sqlite3.Error for invalid SQL.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        max_rows = self.max_rows if max_rows is None else max_rows
+        deadline = time.monotonic() + timeout
+
+        with self.connection() as conn:
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_INTERVAL)
+            try:
+                cursor = conn.execute(sql, params)
+                columns = [d[0] for d in cursor.description or ()]
+                rows = []
+                while len(rows) <= max_rows:
+                    batch = cursor.fetchmany(min(500, max_rows + 1 - len(rows)))
+                    if not batch:
+                        break
+                    rows.extend(batch)
+                cursor.close()
+            except sqlite3.OperationalError as e:
+                if time.monotonic() > deadline and 'interrupt' in str(e):
+                    raise QueryTimeout(f"Query exceeded the {timeout:g}s time limit") from e
+                raise
+            finally:
+                conn.set_progress_handler(None, 0)
+
+        truncated = len(rows) > max_rows
+        return columns, rows[:max_rows], truncated
+
+    def generation(self) -> int:
+        """
+        A counter that moves whenever another connection commits to the database.
+
+        PRAGMA data_version on a dedicated, never-writing connection changes
+        after every commit made by anyone else, the app and other processes
+        included, and costs no disk read when nothing changed.
+        """
+        with self._watcher_lock:
+            if self._watcher is None:
+                self._watcher = self._connect()
+            data_version = self._watcher.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._generation += 1
+            return self._generation
+
+    def close(self) -> None:
+        with self._watcher_lock:
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,79 @@
+"""In-memory cache of SQL query results, invalidated when the database changes"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# String literals and quoted identifiers are kept verbatim, everything else is case/space-folded
+_SQL_PART = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])|(\s+)|([^'"`\[\s]+|.)""")
+
+
+def normalize_sql(sql: str) -> str:
+    """Fold case and whitespace outside literals and drop trailing semicolons"""
+    parts = []
+    for quoted, space, other in _SQL_PART.findall(sql.strip().rstrip(';').strip()):
+        if quoted:
+            parts.append(quoted)
+        elif space:
+            parts.append(' ')
+        else:
+            parts.append(other.lower())
+    return ''.join(parts)
+
+
+class ResultCache:
+    """
+    LRU cache of query results keyed on (database, normalized SQL).
+
+    Each database has its own generation, supplied by the caller (see
+    ReadOnlyPool.generation()); when it changes, every entry cached for that
+    database under an older generation is dropped.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._generations: Dict[Hashable, Hashable] = {}
+        self._entries: 'OrderedDict[Tuple[Hashable, str], Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sync(self, database: Hashable, generation: Hashable) -> None:
+        if self._generations.get(database) != generation:
+            for key in [key for key in self._entries if key[0] == database]:
+                del self._entries[key]
+            self._generations[database] = generation
+
+    def get(self, database: Hashable, sql: str, generation: Hashable) -> Optional[Any]:
+        key = (database, normalize_sql(sql))
+        with self._lock:
+            self._sync(database, generation)
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, database: Hashable, sql: str, generation: Hashable, result: Any) -> None:
+        key = (database, normalize_sql(sql))
+        with self._lock:
+            self._sync(database, generation)
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+            'databases': len(self._generations)
+        }
@@ -0,0 +1,60 @@
+"""
+Core-level transaction reads: plain tuples in, API dicts out
+
+Listing and export select columns straight into tuples instead of hydrating
+Transaction objects. Datetime columns are read as their stored text and
+turned into the ISO strings to_dict() produces by SQLite itself. rawPayload
+is only selected when asked for, from its side table; the decompressed JSON
+of a whole page is then parsed with a single json.loads call.
+"""
+import json
+from typing import Callable, List, Sequence
+
+from sqlalchemy import DateTime, String, case, func, select, type_coerce
+
+from models import API_FIELDS, Transaction, TransactionPayload, decompress_payload
+
+
+def _iso_text(column):
+    """SQL expression giving datetime.isoformat() of a stored 'YYYY-MM-DD HH:MM:SS[.ffffff]' value"""
+    raw = type_coerce(column, String)
+    return case(
+        (raw.like('%.000000'), func.replace(func.substr(raw, 1, 19), ' ', 'T')),
+        else_=func.replace(raw, ' ', 'T')
+    )
+
+
+def columns(fields: Sequence[str]) -> list:
+    """Select-list for the given API fields, dates already formatted by SQLite"""
+    selected = []
+    for field in fields:
+        if field == 'rawPayload':
+            selected.append(
+                select(TransactionPayload.data)
+                .where(TransactionPayload.transaction_id == Transaction.id)
+                .scalar_subquery().label('raw_payload')
+            )
+            continue
+        column = getattr(Transaction, API_FIELDS[field])
+        selected.append(_iso_text(column).label(column.key) if isinstance(column.type, DateTime) else column)
+    return selected
+
+
+def serializer(fields: Sequence[str]) -> Callable[[Sequence[tuple]], List[dict]]:
+    """Build a rows -> list of API dicts mapper; the field layout is resolved once"""
+    fields = list(fields)
+    if 'rawPayload' not in fields:
+        return lambda rows: [dict(zip(fields, row)) for row in rows]
+    raw_index = fields.index('rawPayload')
+
+    def serialize(rows: Sequence[tuple]) -> List[dict]:
+        # every payload of the batch in one parse; empty ones become null like in to_dict()
+        payloads = json.loads('[' + ','.join(decompress_payload(row[raw_index]) or 'null' for row in rows) + ']')
+        result = []
+        for row, payload in zip(rows, payloads):
+            item = dict(zip(fields, row))
+            item['rawPayload'] = payload
+            result.append(item)
+        return result
+
+    return serialize
@@ -0,0 +1,188 @@
+"""
+Per-user transaction databases
+
+Each user's transactions live in their own SQLite file (<directory>/<user_id>.db)
+with the full schema, indexes and spending aggregates. Queries for one user
+only ever touch that user's file, and writes for different users take
+different database locks. Engines are kept in a bounded LRU so thousands of
+users do not mean thousands of open files.
+
+Usage (move the rows of a shared multi-user database into per-user files):
+    python shards.py instance/synthetic_transactions.db instance/users
+"""
+import argparse
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Set
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db, Transaction, compress_payload
+import aggregates
+import migrations
+import storage
+
+DEFAULT_MAX_OPEN = 64
+
+_USER_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def validate_user_id(user_id: str) -> str:
+    """User ids become file names, so only letters, digits, '-' and '_' are accepted"""
+    if not isinstance(user_id, str) or not _USER_ID.match(user_id):
+        raise ValueError(f"Invalid userId: {user_id!r}")
+    return user_id
+
+
+class ShardRouter:
+    def __init__(self, directory: str, max_open: int = DEFAULT_MAX_OPEN):
+        self.directory = directory
+        self.max_open = max_open
+        self.opened = 0
+        self.evicted = 0
+        self._engines: 'OrderedDict[str, object]' = OrderedDict()
+        self._lock = threading.Lock()
+        # files already created and upgraded by this process, so reopening one only needs an engine
+        self._initialised: Set[str] = set()
+        self._path_locks: Dict[str, threading.Lock] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, user_id: str) -> str:
+        return os.path.join(self.directory, f"{validate_user_id(user_id)}.db")
+
+    def engine_for(self, user_id: str):
+        """The user's engine, creating and upgrading their database the first time this process opens it"""
+        path = self.path_for(user_id)
+        with self._lock:
+            engine = self._engines.get(user_id)
+            if engine is not None:
+                self._engines.move_to_end(user_id)
+                return engine
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+
+        engine = storage.configure(create_engine(f"sqlite:///{path}"))
+        # schema work only holds this user's lock, never the router's
+        with path_lock:
+            if path not in self._initialised:
+                db.metadata.create_all(engine)
+                migrations.upgrade(engine)
+                with Session(engine) as session:
+                    aggregates.ensure_built(session)
+                self._initialised.add(path)
+
+        with self._lock:
+            current = self._engines.get(user_id)
+            if current is not None:
+                # another request opened it in the meantime
+                engine.dispose()
+                self._engines.move_to_end(user_id)
+                return current
+            self._engines[user_id] = engine
+            self.opened += 1
+
+            while len(self._engines) > self.max_open:
+                _, oldest = self._engines.popitem(last=False)
+                # connections still checked out are closed when they are returned
+                oldest.dispose()
+                self.evicted += 1
+            return engine
+
+    def session(self, user_id: str) -> Session:
+        return Session(self.engine_for(user_id))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'open': len(self._engines), 'opened': self.opened, 'evicted': self.evicted}
+
+
+def split_database(source: str, router: ShardRouter) -> Dict[str, Dict[str, int]]:
+    """
+    Copy every user's rows of a shared database into their own file; the
+    source file is only read. Returns per user the rows copied, the rows
+    already present from an earlier run (same id and trx_id) and the
+    conflicts: rows not copied because their id or trx_id is taken by a
+    different row in the user's file.
+    """
+    with sqlite3.connect(f"file:{source}?mode=ro", uri=True) as conn:
+        source_columns = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+        if 'user_id' not in source_columns:
+            raise ValueError(f"{source} has no user_id column")
+        has_payload_table = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transaction_payloads'"
+        ).fetchone() is not None
+        user_ids = [row[0] for row in conn.execute(
+            "SELECT DISTINCT user_id FROM transactions WHERE user_id IS NOT NULL AND user_id != ''"
+        )]
+
+    columns = ', '.join(c.name for c in Transaction.__table__.columns if c.name in source_columns)
+    # a copied row: same id when the source has ids, else the same (unique) trx_id
+    if 'id' in source_columns:
+        same_row = "m.id = t.id AND m.trx_id = t.trx_id"
+    else:
+        same_row = "t.trx_id != '' AND m.trx_id = t.trx_id"
+    if has_payload_table and 'id' in source_columns:
+        payloads = ("SELECT m.id, p.data FROM source.transactions t "
+                    "JOIN source.transaction_payloads p ON p.transaction_id = t.id")
+    elif 'raw_payload' in source_columns:
+        # files from before the payload table: compress the old column on the way
+        payloads = ("SELECT m.id, compress_payload(t.raw_payload) FROM source.transactions t")
+    else:
+        payloads = None
+
+    results = {}
+    for user_id in user_ids:
+        if not _USER_ID.match(str(user_id)):
+            print(f"Skipping user id that cannot be a file name: {user_id!r}")
+            continue
+        path = router.path_for(user_id)
+        router.engine_for(user_id)  # creates the schema
+        conn = sqlite3.connect(path, uri=True)
+        conn.create_function('compress_payload', 1, compress_payload)
+        try:
+            conn.execute("ATTACH DATABASE ? AS source", (f"file:{source}?mode=ro",))
+            with conn:
+                total, existing = conn.execute(
+                    f"SELECT COUNT(*), COUNT(m.id) FROM source.transactions t "
+                    f"LEFT JOIN main.transactions m ON {same_row} WHERE t.user_id = ?", (user_id,)
+                ).fetchone()
+                copied = conn.execute(
+                    f"INSERT OR IGNORE INTO transactions ({columns}) "
+                    f"SELECT {columns} FROM source.transactions WHERE user_id = ?", (user_id,)
+                ).rowcount
+                if payloads:
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO transaction_payloads (transaction_id, data) {payloads} "
+                        f"JOIN main.transactions m ON {same_row} WHERE t.user_id = ?", (user_id,)
+                    )
+                for sql in aggregates.REBUILD_SQL:
+                    conn.execute(sql)
+            conn.execute("DETACH DATABASE source")
+        finally:
+            conn.close()
+        results[user_id] = {'copied': copied, 'existing': existing, 'conflicts': total - existing - copied}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a shared transactions database into per-user databases")
+    parser.add_argument('source_db', help="Database whose transactions have a user_id")
+    parser.add_argument('directory', help="Directory of the per-user databases")
+    args = parser.parse_args()
+
+    results = split_database(args.source_db, ShardRouter(args.directory))
+    for user_id, counts in results.items():
+        print(f"{user_id}: {counts['copied']} copied, {counts['existing']} already present, "
+              f"{counts['conflicts']} conflicts")
+    conflicts = sum(counts['conflicts'] for counts in results.values())
+    print(f"Split {sum(counts['copied'] for counts in results.values())} transactions into {len(results)} user databases")
+    if conflicts:
+        raise SystemExit(f"{conflicts} transactions were not copied: their id or trx_id is already "
+                         f"used by a different transaction in the user's database")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Bounded worker pool with single-flight coalescing for slow (LLM-backed) jobs
+
+A job is a generator of (event, data) pairs. Jobs submitted under the key of
+one that is still running are not started again: the caller subscribes to the
+running one and replays its events from the start. When running plus queued
+jobs reach the limit, submit() raises Overloaded so the caller can answer 429
+instead of piling up threads.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Flight:
+    """Events of one running job, readable by any number of subscribers"""
+
+    def __init__(self):
+        self._events: List[Event] = []
+        self._done = False
+        self._cond = threading.Condition()
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        with self._cond:
+            self._events.append((event, data))
+            self._cond.notify_all()
+
+    def finish(self) -> None:
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def __iter__(self) -> Iterator[Event]:
+        seen = 0
+        while True:
+            with self._cond:
+                while seen == len(self._events) and not self._done:
+                    self._cond.wait()
+                batch = self._events[seen:]
+                if not batch:
+                    return
+            seen += len(batch)
+            yield from batch
+
+
+class SingleFlightExecutor:
+    def __init__(self, max_workers: int = 4, max_queue: int = 16):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.started = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._pending = 0
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat')
+
+    def submit(self, key: Hashable, job: Callable[[], Iterator[Event]]) -> Tuple[Flight, bool]:
+        """
+        Run job() on the pool, or join the running job with the same key.
+        Returns (flight, joined). Raises Overloaded when the queue is full.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, True
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise Overloaded(f"{self._pending} chat requests already running or queued")
+            self._pending += 1
+            self.started += 1
+            flight = self._flights[key] = Flight()
+        self._executor.submit(self._run, key, flight, job)
+        return flight, False
+
+    def _run(self, key: Hashable, flight: Flight, job: Callable[[], Iterator[Event]]) -> None:
+        try:
+            for event, data in job():
+                flight.publish(event, data)
+        except Exception as e:
+            logger.exception("Chat job failed")
+            flight.publish('error', {'error': str(e)})
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self._pending -= 1
+            flight.finish()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'running_or_queued': self._pending,
+                'in_flight': len(self._flights),
+                'started': self.started,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,168 @@
+"""
+Question -> SQL templates learned from successful chat queries
+
+A question is normalized and its literal values (known merchant names,
+dates, months, years and amounts) are replaced by numbered slots, e.g.
+
+    "How much did I spend at Migros in March 2025?"
+    -> "how much did i spend at {merchant0} in {month0}"
+
+When the SQL the model wrote for it contains exactly those values, they are
+replaced by the same slots and the pair is stored. A later question with the
+same shape ("... at Coop in April 2025?") is answered by filling the slots,
+without asking the model for the SQL again.
+"""
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MONTHS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6, 'july': 7,
+    'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12,
+    'gennaio': 1, 'febbraio': 2, 'marzo': 3, 'aprile': 4, 'maggio': 5, 'giugno': 6, 'luglio': 7,
+    'agosto': 8, 'settembre': 9, 'ottobre': 10, 'novembre': 11, 'dicembre': 12,
+}
+
+# Filler that does not change what is being asked
+_FILLER = re.compile(r"\b(?:please|per favore|can you|could you|show me|tell me|mostrami|dimmi)\b")
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_MONTH_YEAR = re.compile(rf"\b({'|'.join(MONTHS)})\s+(\d{{4}})\b")
+_YEAR = re.compile(r"\b(20\d{2}|19\d{2})\b")
+_AMOUNT = re.compile(r"(?<![\w.{])(\d+(?:\.\d+)?)(?![\w}])")
+_SQL_DATE_LITERAL = re.compile(r"'\d{4}-\d{2}")
+
+
+def normalize(question: str) -> str:
+    text = question.lower().replace('?', ' ').replace('!', ' ')
+    text = _FILLER.sub(' ', text)
+    return ' '.join(re.sub(r"[^\w\s.\-']", ' ', text).split()).strip(' .')
+
+
+def sql_quote(value: str) -> str:
+    return value.replace("'", "''")
+
+
+class TemplateCache:
+    """SQLite-backed store of question templates and their parameterized SQL"""
+
+    def __init__(self, path: str):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sql_templates (
+                template TEXT PRIMARY KEY,
+                sql TEXT NOT NULL,
+                stop INTEGER NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self._merchants: List[Tuple[str, str]] = []
+        self._merchant_pattern = None
+
+    def set_merchants(self, names: Iterable[str]) -> None:
+        """Merchant names recognized as slots; longer names win over their prefixes"""
+        by_lower = {normalize(n): n for n in names if n and len(normalize(n)) > 2}
+        self._merchants = sorted(by_lower.items(), key=lambda m: -len(m[0]))
+        if self._merchants:
+            self._merchant_pattern = re.compile(
+                '|'.join(rf"(?<!\w){re.escape(lower)}(?!\w)" for lower, _ in self._merchants)
+            )
+        else:
+            self._merchant_pattern = None
+
+    def parameterize(self, question: str) -> Tuple[str, Dict[str, str]]:
+        """The question's template and slot values, rendered as they would appear in SQL"""
+        text = normalize(question)
+        slots: Dict[str, str] = {}
+
+        def replacer(kind: str, render):
+            def sub(match):
+                name = f"{kind}{sum(1 for s in slots if s.startswith(kind))}"
+                slots[name] = render(match)
+                return f"{{{name}}}"
+            return sub
+
+        if self._merchant_pattern is not None:
+            canonical = dict(self._merchants)
+            text = self._merchant_pattern.sub(replacer('merchant', lambda m: canonical[m.group(0)]), text)
+        text = _ISO_DATE.sub(replacer('date', lambda m: m.group(0)), text)
+        text = _MONTH_YEAR.sub(replacer('month', lambda m: f"{m.group(2)}-{MONTHS[m.group(1)]:02d}"), text)
+        text = _YEAR.sub(replacer('year', lambda m: m.group(0)), text)
+        text = _AMOUNT.sub(replacer('amount', lambda m: m.group(0)), text)
+        return text, slots
+
+    def lookup(self, question: str) -> Optional[Tuple[str, bool]]:
+        """(sql, stop) for a question matching a known template, else None"""
+        template, slots = self.parameterize(question)
+        with self._lock:
+            row = self._conn.execute("SELECT sql, stop FROM sql_templates WHERE template = ?", (template,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE sql_templates SET uses = uses + 1 WHERE template = ?", (template,))
+            self._conn.commit()
+            self.hits += 1
+        sql = row[0]
+        for name, value in slots.items():
+            sql = sql.replace(f"{{{name}}}", sql_quote(value))
+        return sql, bool(row[1])
+
+    def learn(self, question: str, sql: str, stop: bool) -> bool:
+        """
+        Store the SQL that answered question, with its slot values replaced.
+
+        Skipped when a slot value does not appear in the SQL (reusing it would
+        ignore the value), when an amount appears more than once (it could be
+        a LIMIT or another constant), or when the SQL still hard-codes a date
+        afterwards: it is either relative to today or derived from a slot (the
+        end of a month range), and would be wrong for other values.
+        """
+        template, slots = self.parameterize(question)
+        values = list(slots.values())
+        if len(set(v.lower() for v in values)) != len(values):
+            return False
+
+        parameterized = sql
+        for name, value in slots.items():
+            if name.startswith('amount'):
+                pattern = re.compile(rf"(?<![\w.']){re.escape(value)}(?:\.0+)?(?![\w.'])")
+            else:
+                pattern = re.compile(re.escape(sql_quote(value)), re.IGNORECASE)
+            found = len(pattern.findall(parameterized))
+            if found == 0 or (found > 1 and name.startswith('amount')):
+                return False
+            parameterized = pattern.sub(lambda m: f"{{{name}}}", parameterized)
+
+        if _SQL_DATE_LITERAL.search(parameterized):
+            return False
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sql_templates (template, sql, stop, created_at) VALUES (?, ?, ?, ?)",
+                (template, parameterized, int(stop), time.time())
+            )
+            self._conn.commit()
+        return True
+
+    def forget(self, question: str) -> None:
+        """Drop the template of a question whose SQL failed"""
+        template, _ = self.parameterize(question)
+        with self._lock:
+            self._conn.execute("DELETE FROM sql_templates WHERE template = ?", (template,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM sql_templates").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries
+        }
@@ -0,0 +1,179 @@
+"""
+SQLite storage tuning and the single-writer queue
+
+Every connection opened by a configured engine gets the PRAGMAS below: WAL
+lets readers keep reading the last committed snapshot while a write is in
+progress, so long analytic reads and writes no longer block each other.
+
+Writes go through one Writer thread on a separate one-connection engine.
+Jobs submitted close together are run in the same transaction (each in its
+own savepoint, so one failing job does not take the others down) and
+committed once, which turns many small commits into a few larger ones.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+logger = logging.getLogger(__name__)
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    # with WAL, NORMAL only risks the last commits on power loss, never corruption
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,        # KiB, i.e. 64 MB of page cache per connection
+    'mmap_size': 268435456,      # read pages through a 256 MB memory map
+    'busy_timeout': 5000,        # ms to wait for a lock instead of failing at once
+}
+
+# Jobs the writer groups into one commit, and how long it waits for more
+MAX_BATCH = 64
+MAX_BATCH_DELAY = 0.005
+
+
+def configure(engine, pragmas: Dict[str, Any] = PRAGMAS, query_only: bool = False):
+    """Apply the pragmas to every new connection of engine (and mark it read-only if asked)"""
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        if query_only:
+            cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+    return engine
+
+
+def begin(session: Session) -> None:
+    """
+    Open the session's transaction in SQLite right away.
+
+    pysqlite only sends BEGIN ahead of INSERT/UPDATE/DELETE, so a SAVEPOINT
+    issued first runs outside any transaction and its RELEASE commits on its
+    own. Call this before using begin_nested() for a group of writes that
+    must commit together.
+    """
+    dbapi_connection = session.connection().connection.driver_connection
+    if not dbapi_connection.in_transaction:
+        dbapi_connection.execute("BEGIN")
+
+
+def write_engine(url):
+    """One shared connection: SQLite allows a single writer anyway"""
+    return configure(create_engine(url, poolclass=StaticPool, connect_args={'check_same_thread': False}))
+
+
+class Writer:
+    """
+    Serializes writes to one database on a background thread.
+
+    submit(job) queues job(session) and returns a Future with its return
+    value, resolved once the transaction that ran it has committed.
+    Exclusive jobs (e.g. bulk inserts that commit in chunks themselves) run
+    alone and manage their own commits.
+    """
+
+    def __init__(self, engine, max_batch: int = MAX_BATCH, max_delay: float = MAX_BATCH_DELAY):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.jobs = 0
+        self.batches = 0
+        self._queue: 'queue.Queue[Tuple[Callable, bool, Future]]' = queue.Queue()
+        # a job taken off the queue that has to start the next batch (only the writer thread uses it)
+        self._held = None
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Callable[[Session], Any], exclusive: bool = False) -> Future:
+        future = Future()
+        self._queue.put((job, exclusive, future))
+        return future
+
+    def run(self, job: Callable[[Session], Any], exclusive: bool = False, timeout: Optional[float] = 30) -> Any:
+        """
+        submit() and wait for the result, re-raising the job's exception.
+        Exclusive jobs are waited for without a timeout: they can take long and
+        keep committing whether or not anyone still waits for them.
+        """
+        return self.submit(job, exclusive).result(None if exclusive else timeout)
+
+    def _next_batch(self) -> List[Tuple[Callable, bool, Future]]:
+        if self._held is not None:
+            batch, self._held = [self._held], None
+        else:
+            batch = [self._queue.get()]
+        if batch[0][1]:
+            return batch
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item[1]:
+                # exclusive jobs go in a batch of their own, right after this one
+                self._held = item
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                with Session(self.engine) as session:
+                    if batch[0][1]:
+                        self._run_exclusive(session, *batch[0])
+                    else:
+                        self._run_batch(session, batch)
+            except Exception as e:
+                # e.g. the database cannot be opened: fail this batch, keep serving the next ones
+                logger.exception("Write batch failed")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.jobs += len(batch)
+            self.batches += 1
+
+    @staticmethod
+    def _run_exclusive(session: Session, job: Callable, exclusive: bool, future: Future) -> None:
+        try:
+            result = job(session)
+            session.commit()
+            future.set_result(result)
+        except Exception as e:
+            session.rollback()
+            future.set_exception(e)
+
+    @staticmethod
+    def _run_batch(session: Session, batch: List[Tuple[Callable, bool, Future]]) -> None:
+        done = []
+        begin(session)
+        for job, _, future in batch:
+            try:
+                with session.begin_nested():
+                    result = job(session)
+                done.append((future, result))
+            except Exception as e:
+                future.set_exception(e)
+        try:
+            session.commit()
+        except Exception as e:
+            logger.exception("Write batch failed to commit")
+            session.rollback()
+            for future, _ in done:
+                future.set_exception(e)
+            return
+        for future, result in done:
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, int]:
+        return {'jobs': self.jobs, 'batches': self.batches,
+                'queued': self._queue.qsize() + (self._held is not None)}
@@ -0,0 +1,169 @@
+"""
+Concurrency stress test for the storage layer: writers never block readers
+
+Writer threads insert transactions (with their aggregate updates) through
+storage.Writer while reader threads run full-table analytic scans on their
+own engine. Reports read latency, lock errors and how many commits the
+writes were grouped into. With --no-wal the same load runs with the default
+rollback journal and each writer committing on its own connection, for
+comparison. Exits with status 1 when any read failed.
+
+Usage:
+    python stress_storage.py [--rows 100000] [--seconds 10] [--readers 4] [--writers 8] [--no-wal]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models import db, Transaction
+import aggregates
+import storage
+from bench_listing import fill
+
+SCAN_SQL = text(
+    "SELECT direction, merchant_name, COUNT(*), SUM(amount), MAX(amount) "
+    "FROM transactions GROUP BY direction, merchant_name"
+)
+
+
+def new_transaction(writer_id: int, n: int) -> Transaction:
+    now = datetime.utcnow()
+    return Transaction(
+        trx_id=f'S{writer_id}-{n}', direction='OUT', amount=12.5, currency='CHF',
+        merchant_name='Migros', booking_date=now, value_date=now, trx_type='debit'
+    )
+
+
+def insert(transaction: Transaction):
+    def job(session):
+        session.add(transaction)
+        aggregates.apply_insert(session, [transaction])
+    return job
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.read_latencies = []
+        self.read_errors = 0
+        self.writes = 0
+        self.write_errors = 0
+
+
+def reader(engine, stop: threading.Event, counters: Counters) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(SCAN_SQL).fetchall()
+        except OperationalError:
+            with counters.lock:
+                counters.read_errors += 1
+            continue
+        with counters.lock:
+            counters.read_latencies.append(time.perf_counter() - started)
+
+
+def queued_writer(writer: storage.Writer, writer_id: int, stop: threading.Event, counters: Counters) -> None:
+    n = 0
+    while not stop.is_set():
+        n += 1
+        try:
+            writer.run(insert(new_transaction(writer_id, n)))
+            ok = True
+        except OperationalError:
+            ok = False
+        with counters.lock:
+            if ok:
+                counters.writes += 1
+            else:
+                counters.write_errors += 1
+
+
+def direct_writer(engine, writer_id: int, stop: threading.Event, counters: Counters) -> None:
+    n = 0
+    while not stop.is_set():
+        n += 1
+        try:
+            with Session(engine) as session:
+                insert(new_transaction(writer_id, n))(session)
+                session.commit()
+            ok = True
+        except OperationalError:
+            ok = False
+        with counters.lock:
+            if ok:
+                counters.writes += 1
+            else:
+                counters.write_errors += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent writes never block analytic reads")
+    parser.add_argument('--rows', type=int, default=100000, help="Synthetic rows to start with")
+    parser.add_argument('--seconds', type=float, default=10, help="How long to run the load")
+    parser.add_argument('--readers', type=int, default=4, help="Threads running full-table scans")
+    parser.add_argument('--writers', type=int, default=8, help="Threads inserting transactions")
+    parser.add_argument('--no-wal', action='store_true',
+                        help="Baseline: rollback journal and one connection per writer, no writer queue")
+    args = parser.parse_args()
+
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stress.db')}"
+    setup = create_engine(url)
+    db.metadata.create_all(setup)
+    fill(setup, args.rows)
+    with Session(setup) as session:
+        aggregates.ensure_built(session)
+    setup.dispose()
+
+    if args.no_wal:
+        pragmas = dict(storage.PRAGMAS, journal_mode='DELETE', synchronous='FULL')
+        read_engine = storage.configure(create_engine(url), pragmas, query_only=True)
+        write_engine = storage.configure(create_engine(url, pool_size=args.writers), pragmas)
+        writer = None
+    else:
+        read_engine = storage.configure(create_engine(url), query_only=True)
+        writer = storage.Writer(storage.write_engine(url))
+
+    counters = Counters()
+    stop = threading.Event()
+    threads = [threading.Thread(target=reader, args=(read_engine, stop, counters)) for _ in range(args.readers)]
+    for i in range(args.writers):
+        if writer:
+            threads.append(threading.Thread(target=queued_writer, args=(writer, i, stop, counters)))
+        else:
+            threads.append(threading.Thread(target=direct_writer, args=(write_engine, i, stop, counters)))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(counters.read_latencies)
+    print(f"Mode:          {'rollback journal, direct writes' if args.no_wal else 'WAL, single writer'}")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"Reads:         {len(latencies)} scans, median {statistics.median(latencies) * 1000:.0f} ms, "
+              f"p99 {p99 * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms")
+    print(f"Read errors:   {counters.read_errors}")
+    print(f"Writes:        {counters.writes / args.seconds:.0f}/s ({counters.writes} total), errors: {counters.write_errors}")
+    if writer:
+        stats = writer.stats()
+        print(f"Commits:       {stats['batches']} for {stats['jobs']} writes "
+              f"({stats['jobs'] / max(1, stats['batches']):.1f} per commit)")
+
+    if counters.read_errors or not latencies:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Data versions of tables, persisted in the database itself
+
+A table's row in table_versions is bumped once per write transaction by the
+code that maintains what is derived from the table: for transactions that is
+aggregates.py, which every write path (API workers, import_data.py,
+categorization, shards.py) already goes through in the same transaction as
+its insert, update or delete. Anything derived from the table can be cached
+with the version it was computed at and reused while the version is
+unchanged, in every worker process.
+"""
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import select, text
+
+from models import SpendingAggregate, TableVersion
+
+
+class Version(NamedTuple):
+    epoch: str  # random per database file, so a recreated file never repeats a version
+    value: int
+    changed_at: Optional[datetime]
+
+
+class DataVersion:
+    """Write counter of a table, see bump()"""
+
+    # per-row triggers of earlier versions, dropped by install()
+    _TRIGGER_TABLES = ('transactions', 'spending_aggregates')
+
+    def __init__(self, table: str):
+        self.table = table
+        self.bump_sql = (
+            f"UPDATE table_versions SET value = value + 1, changed_at = CURRENT_TIMESTAMP "
+            f"WHERE name = '{self.table}'"
+        )
+
+    def install_sql(self) -> List[str]:
+        statements = [
+            f"INSERT OR IGNORE INTO table_versions (name, epoch, value, changed_at) "
+            f"VALUES ('{self.table}', lower(hex(randomblob(4))), 0, CURRENT_TIMESTAMP)"
+        ]
+        for table in self._TRIGGER_TABLES:
+            for event in ('insert', 'update', 'delete'):
+                statements.append(f"DROP TRIGGER IF EXISTS {table}_version_{event}")
+        return statements
+
+    def install(self, conn) -> None:
+        """Create the version row (idempotent)"""
+        for table in (TableVersion.__table__, SpendingAggregate.__table__):
+            table.create(conn, checkfirst=True)
+        for sql in self.install_sql():
+            conn.execute(text(sql))
+
+    def bump(self, session) -> None:
+        """Count one write; call inside the writing transaction, once per commit"""
+        session.execute(text(self.bump_sql))
+
+    def current(self, session) -> Version:
+        """The table's committed version, as seen by session's database"""
+        row = session.execute(
+            select(TableVersion.epoch, TableVersion.value, TableVersion.changed_at)
+            .where(TableVersion.name == self.table)
+        ).first()
+        return Version(*row) if row is not None else Version('', 0, None)
+
+
+# Bumped by every committed write to transactions, see aggregates.py
+transactions = DataVersion('transactions')
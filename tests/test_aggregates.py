@@ -0,0 +1,103 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+from models import db, SpendingAggregate, Transaction
+import aggregates
+import migrations
+
+
+def make_session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'transactions.db'}")
+    db.metadata.create_all(engine)
+    migrations.upgrade(engine)
+    return engine, Session(engine)
+
+
+def stored(session):
+    return sorted(
+        (a.dimension, a.key, a.direction, a.count, round(a.total, 2), a.max_amount)
+        for a in session.scalars(select(SpendingAggregate))
+    )
+
+
+def rebuilt(session):
+    aggregates.rebuild(session)
+    result = stored(session)
+    session.rollback()
+    return result
+
+
+def add(session, trx_id, amount, merchant='Migros', booking_date=datetime(2024, 1, 15)):
+    transaction = Transaction(trx_id=trx_id, direction='OUT', amount=amount, currency='CHF',
+                              merchant_name=merchant, booking_date=booking_date)
+    session.add(transaction)
+    session.flush()
+    aggregates.apply_insert(session, [transaction])
+    session.commit()
+    return transaction
+
+
+def remove(session, transaction):
+    session.delete(transaction)
+    session.flush()
+    aggregates.apply_delete(session, [transaction])
+    session.commit()
+
+
+def test_insert_and_delete_match_a_rebuild(tmp_path):
+    engine, session = make_session(tmp_path)
+    small = add(session, 'A', 10.0)
+    largest = add(session, 'B', 50.0, merchant='Coop')
+    add(session, 'C', 30.0, booking_date=datetime(2024, 2, 1))
+    assert stored(session) == rebuilt(session)
+    assert aggregates.totals(session, 'OUT') == (3, 90.0, 50.0)
+
+    # the deleted row held the max: it is recomputed from the remaining rows
+    remove(session, largest)
+    assert aggregates.totals(session, 'OUT') == (2, 40.0, 30.0)
+    assert stored(session) == rebuilt(session)
+
+    # the last row of a key drops its aggregate
+    remove(session, small)
+    assert ('month', '2024-01') not in {(a.dimension, a.key) for a in session.scalars(select(SpendingAggregate))}
+    assert stored(session) == rebuilt(session)
+
+
+def test_max_recompute_matches_legacy_date_text(tmp_path):
+    engine, session = make_session(tmp_path)
+    with engine.begin() as conn:
+        # written by an old import: no microseconds
+        conn.execute(text(
+            "INSERT INTO transactions (trx_id, direction, amount, currency, booking_date) "
+            "VALUES ('L', 'OUT', 40, 'CHF', '2024-01-01 00:00:00')"
+        ))
+        aggregates.rebuild(conn)
+    remove(session, add(session, 'N', 60.0, booking_date=datetime(2024, 1, 20)))
+    month = session.get(SpendingAggregate, {'dimension': 'month', 'key': '2024-01', 'direction': 'OUT'})
+    assert (month.count, month.max_amount) == (1, 40.0)
+
+
+def test_dedupe_rebuilds_the_aggregates(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'transactions.db'}")
+    with engine.begin() as conn:
+        # a database from before the unique trx_id index
+        conn.execute(text(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY, trx_id VARCHAR(100), direction VARCHAR(20), "
+            "amount FLOAT, currency VARCHAR(10), booking_date DATETIME)"
+        ))
+        conn.execute(text(
+            "INSERT INTO transactions (trx_id, direction, amount, currency) "
+            "VALUES ('A', 'OUT', 5, 'CHF'), ('A', 'OUT', 5, 'CHF'), ('B', 'OUT', 7, 'CHF')"
+        ))
+    db.metadata.create_all(engine)
+    migrations.upgrade(engine)
+    with Session(engine) as session:
+        aggregates.rebuild(session)
+        session.commit()
+        assert aggregates.totals(session, 'OUT') == (3, 17.0, 7.0)
+
+    migrations.upgrade(engine, dedupe=True)
+    with Session(engine) as session:
+        assert aggregates.totals(session, 'OUT') == (2, 12.0, 7.0)
@@ -0,0 +1,13 @@
+import pytest
+
+import export
+
+
+def test_parse_fields():
+    assert export.parse_fields(None) == export.DEFAULT_FIELDS
+    assert export.parse_fields(' id, amount ,') == ['id', 'amount']
+    with pytest.raises(ValueError):
+        export.parse_fields('id,nope')
+    # an empty projection would only fail once the response is streaming
+    with pytest.raises(ValueError):
+        export.parse_fields(',')
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from openpyxl import Workbook
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from models import SpendingAggregate
+import aggregates
+import import_data
+
+HEADER = ['TRX_ID', 'TRX_TYPE_SHORT', 'TRX_DATE', 'POINT_OF_SALE_AND_LOCATION', 'AMOUNT']
+
+
+def write_workbook(path, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = import_data.DEFAULT_SHEET
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def stored_aggregates(session):
+    return sorted(
+        (a.dimension, a.key, a.direction, a.count, round(a.total, 2), a.max_amount)
+        for a in session.scalars(select(SpendingAggregate))
+    )
+
+
+def test_overlapping_imports_count_and_maintain_aggregates(tmp_path):
+    db_path = str(tmp_path / 'transactions.db')
+    first = write_workbook(tmp_path / 'first.xlsx', [
+        ['A', 'debit', datetime(2024, 1, 5), 'Migros', 10.0],
+        ['B', 'debit', datetime(2024, 1, 6), 'Coop', 20.0],
+        ['C', 'debit', datetime(2024, 2, 1), 'Migros', 90.0],
+        [None, 'credit', datetime(2024, 2, 2), 'Salary', 1000.0],
+    ])
+    # B unchanged, C moved to another month and lost its max, D new, the row without trx_id repeated
+    second = write_workbook(tmp_path / 'second.xlsx', [
+        ['B', 'debit', datetime(2024, 1, 6), 'Coop', 20.0],
+        ['C', 'debit', datetime(2024, 1, 20), 'Migros', 5.0],
+        ['D', 'debit', datetime(2024, 2, 3), 'Coop', 7.0],
+        [None, 'credit', datetime(2024, 2, 2), 'Salary', 1000.0],
+    ])
+
+    quiet = lambda message: None
+    assert import_data.import_workbook(first, db_path, chunk_size=2, progress=quiet) == \
+        {'inserted': 4, 'updated': 0, 'skipped': 0}
+    assert import_data.import_workbook(second, db_path, chunk_size=2, progress=quiet) == \
+        {'inserted': 1, 'updated': 1, 'skipped': 2}
+    assert import_data.import_workbook(second, db_path, chunk_size=2, progress=quiet) == \
+        {'inserted': 0, 'updated': 0, 'skipped': 4}
+
+    with Session(create_engine(f"sqlite:///{db_path}")) as session:
+        maintained = stored_aggregates(session)
+        aggregates.rebuild(session)
+        assert maintained == stored_aggregates(session)
+        assert aggregates.totals(session, 'debit') == (4, 42.0, 20.0)
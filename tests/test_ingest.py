@@ -0,0 +1,34 @@
+import sqlite3
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db
+import aggregates
+import ingest
+
+
+def test_fallback_commits_rows_with_their_aggregates(tmp_path, monkeypatch):
+    path = tmp_path / 'transactions.db'
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+
+    visible = []
+    apply_insert = aggregates.apply_insert
+
+    def checking_apply_insert(session, rows):
+        # rows of the chunk must not be committed before their aggregates are
+        with sqlite3.connect(path) as conn:
+            visible.append(conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0])
+        apply_insert(session, rows)
+
+    monkeypatch.setattr(aggregates, 'apply_insert', checking_apply_insert)
+    items = [{'trxId': 'A', 'amount': 1}, {'trxId': 'B', 'amount': 2}, {'trxId': 'A', 'amount': 3}]
+    with Session(engine) as session:
+        inserted, failures = ingest.bulk_insert(session, items)
+
+    assert inserted == 2 and [f['index'] for f in failures] == [2]
+    # the chunk's INSERT is rejected before its aggregates, so only the row-by-row replay gets here
+    assert visible == [0]
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT SUM(count) FROM spending_aggregates WHERE dimension = 'total'").fetchone()[0] == 2
@@ -0,0 +1,67 @@
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+from models import db, Transaction
+import queries
+
+
+def make_session(tmp_path, booking_dates):
+    engine = create_engine(f"sqlite:///{tmp_path / 'transactions.db'}")
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for booking_date in booking_dates:
+            conn.execute(text(
+                "INSERT INTO transactions (trx_id, direction, amount, currency, booking_date) "
+                "VALUES ('', 'OUT', 1, 'CHF', :booking_date)"
+            ), {'booking_date': booking_date})
+    return Session(engine)
+
+
+def all_ids(session, limit):
+    ids, args = [], {'limit': str(limit)}
+    for _ in range(20):
+        rows, cursor = queries.paginate(select(Transaction.booking_date, Transaction.id), args, session)
+        ids += [row.id for row in rows]
+        if cursor is None:
+            return ids
+        args['cursor'] = cursor
+    raise AssertionError(f"pagination did not end, ids so far: {ids}")
+
+
+def test_paginate_legacy_date_text(tmp_path):
+    # dates as written by the old pandas import: no microseconds
+    session = make_session(tmp_path, ['2024-01-01 00:00:00'] * 5)
+    assert all_ids(session, 2) == [5, 4, 3, 2, 1]
+
+
+def test_paginate_mixed_date_formats(tmp_path):
+    session = make_session(tmp_path, [
+        '2024-01-01 00:00:00', '2024-01-01 00:00:00.000000', '2024-01-02 00:00:00',
+        None, '2024-01-01 00:00:00', '2023-12-31 23:59:59.500000', None
+    ])
+    assert sorted(all_ids(session, 2)) == [1, 2, 3, 4, 5, 6, 7]
+    assert all_ids(session, 3) == all_ids(session, 100)
+
+
+def filtered_ids(session, **args):
+    rows, _ = queries.paginate(select(Transaction.booking_date, Transaction.id), args, session)
+    return sorted(row.id for row in rows)
+
+
+def test_date_filters_match_both_stored_forms(tmp_path):
+    session = make_session(tmp_path, [
+        '2023-12-31 23:59:59', '2024-01-01 00:00:00', '2024-01-01 00:00:00.000000',
+        '2024-01-31 15:00:00.000000', '2024-01-31 23:59:59', '2024-02-01 00:00:00', None
+    ])
+    assert filtered_ids(session, dateFrom='2024-01-01') == [2, 3, 4, 5, 6]
+    # a bare dateTo includes the whole day
+    assert filtered_ids(session, dateFrom='2024-01-01', dateTo='2024-01-31') == [2, 3, 4, 5]
+    # a dateTo with a time includes that instant in either form
+    assert filtered_ids(session, dateTo='2024-01-01T00:00:00') == [1, 2, 3]
+    assert filtered_ids(session, dateFrom='2024-01-31T15:00:00', dateTo='2024-01-31T15:00:00') == [4]
+
+
+def test_date_filters_convert_offsets_to_utc(tmp_path):
+    session = make_session(tmp_path, ['2023-12-31 23:59:59', '2024-01-01 00:00:00', '2024-01-01 01:00:00'])
+    assert filtered_ids(session, dateFrom='2024-01-01T02:00:00+02:00') == [2, 3]
+    assert filtered_ids(session, dateTo='2024-01-01T00:00:00Z') == [1, 2]
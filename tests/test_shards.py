@@ -0,0 +1,21 @@
+import migrations
+from shards import ShardRouter
+
+
+def test_reopening_an_evicted_user_skips_the_schema_work(tmp_path, monkeypatch):
+    router = ShardRouter(str(tmp_path), max_open=1)
+    upgraded = []
+    upgrade = migrations.upgrade
+
+    def checking_upgrade(engine, *args, **kwargs):
+        # other users' requests must not wait for this one's DDL
+        assert not router._lock.locked()
+        upgraded.append(engine.url.database)
+        return upgrade(engine, *args, **kwargs)
+
+    monkeypatch.setattr(migrations, 'upgrade', checking_upgrade)
+    for user_id in ('alice', 'bob', 'alice', 'bob'):
+        router.engine_for(user_id)
+
+    assert len(upgraded) == 2
+    assert router.stats() == {'open': 1, 'opened': 4, 'evicted': 3}
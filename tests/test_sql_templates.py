@@ -0,0 +1,29 @@
+from sql_templates import TemplateCache
+
+
+def make_cache(tmp_path):
+    cache = TemplateCache(str(tmp_path / 'templates.db'))
+    cache.set_merchants(['Migros', 'Coop'])
+    return cache
+
+
+def test_learns_and_fills_slots(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.learn(
+        "How much did I spend at Migros in March 2025?",
+        "SELECT SUM(amount) FROM transactions WHERE merchant_name = 'Migros' "
+        "AND strftime('%Y-%m', booking_date) = '2025-03'", True
+    )
+    sql, stop = cache.lookup("How much did I spend at Coop in April 2025?")
+    assert "'Coop'" in sql and "'2025-04'" in sql and stop
+
+
+def test_rejects_dates_left_after_parameterizing(tmp_path):
+    cache = make_cache(tmp_path)
+    # the range end is derived from the month but is not a slot
+    assert not cache.learn(
+        "How much did I spend at Migros in March 2025?",
+        "SELECT SUM(amount) FROM transactions WHERE merchant_name = 'Migros' "
+        "AND booking_date >= '2025-03-01' AND booking_date < '2025-04-01'", True
+    )
+    assert cache.lookup("How much did I spend at Coop in April 2025?") is None
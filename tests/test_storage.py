@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+
+from sqlalchemy import text
+
+import storage
+
+
+def make_writer(tmp_path):
+    path = tmp_path / 'writes.db'
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+    return path, storage.Writer(storage.write_engine(f"sqlite:///{path}"))
+
+
+def queue_behind(writer, jobs):
+    """Queue jobs while the writer is held up, so they are run as one batch"""
+    release = threading.Event()
+    blocker = writer.submit(lambda session: release.wait(5), exclusive=True)
+    futures = [writer.submit(job) for job in jobs]
+    release.set()
+    blocker.result(5)
+    return [future.result(5) for future in futures]
+
+
+def insert(session):
+    session.execute(text("INSERT INTO t VALUES (1)"))
+
+
+def test_batch_commits_once(tmp_path):
+    path, writer = make_writer(tmp_path)
+
+    def count_committed(session):
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+    # the earlier jobs of the batch must not be visible to other connections before the batch commits
+    assert queue_behind(writer, [insert, insert, count_committed]) == [None, None, 0]
+    assert count_committed(None) == 2
+    assert writer.stats()['batches'] == 2
+
+
+def test_failed_job_only_rolls_back_itself(tmp_path):
+    path, writer = make_writer(tmp_path)
+
+    def broken(session):
+        session.execute(text("INSERT INTO missing VALUES (1)"))
+
+    release = threading.Event()
+    writer.submit(lambda session: release.wait(5), exclusive=True)
+    futures = [writer.submit(job) for job in (insert, broken, insert)]
+    release.set()
+    assert futures[0].result(5) is None and futures[2].result(5) is None
+    assert futures[1].exception(5) is not None
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+
+
+def test_writer_survives_a_batch_that_cannot_start(tmp_path, monkeypatch):
+    path, writer = make_writer(tmp_path)
+    begin = storage.begin
+
+    def failing_begin(session):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(storage, 'begin', failing_begin)
+    assert isinstance(writer.submit(insert).exception(5), sqlite3.OperationalError)
+
+    monkeypatch.setattr(storage, 'begin', begin)
+    assert writer.run(insert, timeout=5) is None
+
+
+def test_exclusive_job_runs_right_after_its_batch(tmp_path):
+    path, writer = make_writer(tmp_path)
+    order = []
+
+    def job(name):
+        return lambda session: order.append(name)
+
+    release = threading.Event()
+    blocker = writer.submit(lambda session: release.wait(5), exclusive=True)
+    futures = [writer.submit(job('a1')), writer.submit(job('EXCL'), exclusive=True),
+               writer.submit(job('b1')), writer.submit(job('b2'))]
+    release.set()
+    blocker.result(5)
+    for future in futures:
+        future.result(5)
+    assert order == ['a1', 'EXCL', 'b1', 'b2']
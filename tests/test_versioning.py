@@ -0,0 +1,72 @@
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+from models import db, Transaction
+import aggregates
+import ingest
+import migrations
+import versioning
+
+
+def make_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'transactions.db'}"
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    migrations.upgrade(engine)
+    return url, engine
+
+
+def test_one_write_bumps_the_version_once(tmp_path):
+    url, engine = make_database(tmp_path)
+    reader = Session(create_engine(url))
+    before = versioning.transactions.current(reader)
+
+    # what POST /transaction does: one row and its four aggregate upserts
+    with Session(engine) as session:
+        transaction = Transaction(trx_id='T1', direction='OUT', amount=1, currency='CHF', merchant_name='Migros')
+        session.add(transaction)
+        aggregates.apply_insert(session, [transaction])
+        session.commit()
+    after_insert = versioning.transactions.current(reader)
+    assert after_insert.epoch == before.epoch and after_insert.value == before.value + 1
+
+    # a bulk chunk of many rows is still one write
+    with Session(engine) as session:
+        ingest.bulk_insert(session, [{'trxId': f'B{i}', 'amount': i} for i in range(50)])
+    after_bulk = versioning.transactions.current(reader)
+    assert after_bulk.value == after_insert.value + 1
+
+    with Session(engine) as session:
+        transaction = session.scalars(select(Transaction).where(Transaction.trx_id == 'T1')).one()
+        session.delete(transaction)
+        session.flush()
+        aggregates.apply_delete(session, [transaction])
+        session.commit()
+    assert versioning.transactions.current(reader).value == after_bulk.value + 1
+
+
+def test_rebuild_from_another_connection_bumps_the_version(tmp_path):
+    url, engine = make_database(tmp_path)
+    reader = Session(create_engine(url))
+    before = versioning.transactions.current(reader)
+
+    # another process, or a tool like import_data.py, writing with plain SQL
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO transactions (trx_id, direction, amount, currency) VALUES ('T1', 'OUT', 1, 'CHF')"
+        ))
+        for sql in aggregates.REBUILD_SQL:
+            conn.execute(text(sql))
+    assert versioning.transactions.current(reader).value == before.value + 1
+
+
+def test_upgrade_drops_the_per_row_triggers(tmp_path):
+    url, engine = make_database(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TRIGGER transactions_version_insert AFTER INSERT ON transactions BEGIN "
+            "UPDATE table_versions SET value = value + 1 WHERE name = 'transactions'; END"
+        ))
+    migrations.upgrade(engine)
+    with engine.connect() as conn:
+        assert not conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).all()